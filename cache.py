@@ -0,0 +1,139 @@
+'''
+Caching of search results
+'''
+
+import threading
+import time
+from collections import OrderedDict
+
+import vsm
+
+#==============================================================================================
+
+class LRUCache:
+    '''
+    A thread-safe cache that evicts the least recently used entry when it gets full.
+    Entries older than ttl seconds are treated as missing. Counts its hits and misses.
+
+    Every invalidation starts a new generation. A value computed before an invalidation can be stored
+    with the generation it was computed in, so that it is dropped instead of outliving the invalidation.
+    '''
+
+    def __init__(self, max_size: int = 1024, ttl: float = None):
+        '''
+        - max_size: The max number of entries
+        - ttl: If set, entries expire this many seconds after they were stored
+        '''
+
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self.entries = OrderedDict() #key => (time stored, value)
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        self.generation = 0 #Incremented by invalidate
+
+    #==========================================================================================
+
+    def get(self, key, default = None):
+        '''
+        Returns the value stored for key, or default if it is missing or expired
+        '''
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[1]
+
+    #==========================================================================================
+
+    def put(self, key, value, generation: int = None):
+        '''
+        Stores value for key, evicting the least recently used entry if the cache is full.
+        If generation is set and the cache has been invalidated since then, the value is not stored.
+        '''
+
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    #==========================================================================================
+
+    def invalidate(self):
+        '''
+        Removes all entries and starts a new generation. Must be called whenever the index that the values came from changes
+        '''
+
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+    #==========================================================================================
+
+    def stats(self) -> dict:
+        '''
+        Returns the number of hits, misses and stored entries
+        '''
+
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+#==============================================================================================
+
+class QueryCache(LRUCache):
+    '''
+    A cache of search results, keyed on the model, the normalized query and the number of results
+    '''
+
+    def search(self, model: str, query: str, num_results: int, search_function) -> list:
+        '''
+        Returns the cached results for the query, or calls search_function() and caches what it returns.
+
+        - model: The name of the model (e.g. "vsm", "colbert"), since each model returns different results
+        - query: The query. Queries that only differ in case or in the characters removed by vsm.parse_query share an entry
+        - num_results: The number of results
+        - search_function: Called without arguments on a miss, returns the list of results
+
+        If the cache is invalidated while search_function runs, its results may come from the old index, so they are returned but not cached.
+        '''
+
+        key = query_key(model, query, num_results)
+
+        with self.lock:
+            generation = self.generation
+
+        results = self.get(key)
+
+        if results is None:
+            results = search_function()
+            self.put(key, list(results), generation)
+
+        return list(results)
+
+#==============================================================================================
+
+def query_key(model: str, query: str, num_results: int) -> tuple:
+    '''
+    The key of a query in a QueryCache
+    '''
+    return (model, " ".join(vsm.parse_query(query)), num_results)
@@ -5,59 +5,271 @@ Colbert indexing and searching
 import sys;
 sys.path.insert(0, '/home/zoukos/ceid/Information_Retrieval/ColBERT/')
 
-from colbert import Indexer, Searcher
+import os
+from array import array
+from collections import namedtuple
+
+import torch
+from colbert import Indexer, Searcher, IndexUpdater
 from colbert.infra import Run, RunConfig, ColBERTConfig
 #from colbert.data import Queries, Collection
 
 #==============================================================================================
 
-checkpoint = "colbertv2.0"
-doc_maxlen = 512
-nbits = 2
-index_name = "index_1"
-nranks = 1 #Number of GPUs
-kmeans_niters = 4 #Number of iterations of k-means clustering
+#Indexing and searching settings:
+#- checkpoint: The ColBERT model
+#- index_name: Name of the index that is created and searched
+#- doc_maxlen: Max number of tokens of each document
+#- nbits: Number of bits of each compressed embedding dimension
+#- kmeans_niters: Number of iterations of k-means clustering
+#- nranks: Number of processes. Each one encodes a share of the collection on its own GPU. ColBERT only runs more than 1 with GPUs
+#- gpus: Number of GPUs used. None uses every visible GPU, 0 runs on the CPU
+#- threads: Number of torch threads of each process. None keeps the torch default (every core)
+#- index_bsize: Number of documents encoded together
+#- resume: If True, indexing continues from the chunks that an interrupted run already saved, instead of starting over
+Settings = namedtuple("Settings", ["checkpoint", "index_name", "doc_maxlen", "nbits", "kmeans_niters", "nranks", "gpus", "threads", "index_bsize", "resume"],
+                      defaults=["colbertv2.0", "index_1", 512, 2, 4, 1, None, None, 64, False])
+
+DEFAULT_SETTINGS = Settings()
+
+#Stored in the index directory. Contains our document id for each ColBERT passage id
+doc_ids_filename = "doc_ids.bin"
+
+#==============================================================================================
+
+def cpu_settings(threads: int = None, **kwargs) -> Settings:
+    '''
+    Settings for indexing on a machine without GPUs, resuming an interrupted run.
+
+    A single process encodes the whole collection, using threads torch threads so that every core is used.
+    ColBERT's processes synchronize through torch.distributed with CUDA devices, so more than one rank does not work without GPUs.
+
+    - threads: Number of torch threads. By default, the number of cores
+    - kwargs: Any other field of Settings
+    '''
+
+    if threads is None:
+        threads = os.cpu_count() or 1
+
+    return Settings(**{"nranks": 1, "gpus": 0, "threads": threads, "resume": True, **kwargs})
+
+#==============================================================================================
+
+def run_config(settings: Settings) -> RunConfig:
+    '''
+    The RunConfig of the processes that ColBERT starts.
+    The thread limit is set through the environment too, since the processes that ColBERT forks read it when torch starts.
+    '''
+
+    if settings.threads is not None:
+        os.environ["OMP_NUM_THREADS"] = str(settings.threads)
+        os.environ["MKL_NUM_THREADS"] = str(settings.threads)
+        torch.set_num_threads(settings.threads)
+
+    if settings.gpus is None:
+        return RunConfig(nranks=settings.nranks)
+
+    return RunConfig(nranks=settings.nranks, gpus=settings.gpus)
 
 #==============================================================================================
 
-def create_index(docs_dataset):
+def create_index(docs_dataset, settings: Settings = DEFAULT_SETTINGS):
     '''
     Creates an index from the input dataset.
     Accepts a dataset created with load_dataset containing all the documents.
+
+    ColBERT encodes and saves the collection in chunks. With settings.resume, the chunks that are already saved
+    are skipped, so an interrupted run can be restarted with the same settings (see cpu_settings).
     '''
-    global index_name
-    global nbits
-    global doc_maxlen
-    global checkpoint
 
-    with Run().context(RunConfig(nranks=1)):
+    with Run().context(run_config(settings)):
 
-        config = ColBERTConfig(doc_maxlen=doc_maxlen, nbits=nbits, kmeans_niters=4)                                          
+        config = ColBERTConfig(doc_maxlen=settings.doc_maxlen, nbits=settings.nbits, kmeans_niters=settings.kmeans_niters,
+                               index_bsize=settings.index_bsize)
 
-        indexer = Indexer(checkpoint=checkpoint, config=config)
-        indexer.index(name=index_name, collection=docs_dataset["text"], overwrite=True)
+        indexer = Indexer(checkpoint=settings.checkpoint, config=config)
+        indexer.index(name=settings.index_name, collection=docs_dataset["text"], overwrite="resume" if settings.resume else True)
 
         print("PATH: ", indexer.get_index())
 
+        save_doc_ids(indexer.get_index(), array("i", docs_dataset["doc"]))
+
 #==============================================================================================
 
-def get_searcher(docs_dataset):
-    global index_name
+def update_index(searcher, new_texts = None, removed_passage_ids = None, new_doc_ids = None, settings: Settings = DEFAULT_SETTINGS):
+    '''
+    Updates the index that searcher uses in place, instead of recreating it with create_index.
+    Removed passages are dropped from the index, and new texts are encoded with the existing centroids.
+    The changes are written to disk, so later searchers see them too.
+
+    new_doc_ids are our document ids for new_texts. They are added to the searcher's passage id mapping (see get_searcher),
+    and the documents of the removed passages are removed from it, so that rerank no longer scores them.
+    The mapping is saved to the index directory along with the index.
+
+    Returns the ColBERT passage ids of the new texts. They come after the last id of the collection,
+    so they have no row in docs_dataset.
+    '''
+    new_passage_ids = []
+
+    with Run().context(run_config(settings)):
+        updater = IndexUpdater(config=searcher.config, searcher=searcher, checkpoint=settings.checkpoint)
+
+        if removed_passage_ids:
+            updater.remove(removed_passage_ids)
+
+        if new_texts:
+            new_passage_ids = updater.add(new_texts)
+
+        updater.persist_to_disk()
+
+    for passage_id in removed_passage_ids or []:
+        doc_id = searcher.doc_ids[passage_id]
+
+        #The document may already point to a newer passage
+        if searcher.passage_ids.get(doc_id) == passage_id:
+            del searcher.passage_ids[doc_id]
+
+    #Passages without a document id get 0, which no document has
+    if new_passage_ids and max(new_passage_ids) >= len(searcher.doc_ids):
+        searcher.doc_ids.extend([0]*(max(new_passage_ids) + 1 - len(searcher.doc_ids)))
 
+    for passage_id, doc_id in zip(new_passage_ids, new_doc_ids or []):
+        searcher.doc_ids[passage_id] = doc_id
+        searcher.passage_ids[doc_id] = passage_id
+
+    save_doc_ids(searcher.index, searcher.doc_ids)
+
+    return new_passage_ids
+
+#==============================================================================================
+
+def save_doc_ids(index_path, doc_ids: array):
+    '''
+    Stores the mapping from ColBERT passage ids to our document ids in the index directory
+    '''
+    with open(os.path.join(index_path, doc_ids_filename), "wb") as f:
+        doc_ids.tofile(f)
+
+#==============================================================================================
+
+def load_doc_ids(index_path, docs_dataset) -> array:
+    '''
+    Loads the mapping from ColBERT passage ids to our document ids from the index directory.
+    If it is missing, it is created from the "doc" column of docs_dataset (passage i is row i) and stored there.
+    '''
+    path = os.path.join(index_path, doc_ids_filename)
+
+    if not os.path.exists(path):
+        save_doc_ids(index_path, array("i", docs_dataset["doc"]))
+
+    doc_ids = array("i")
+
+    with open(path, "rb") as f:
+        doc_ids.frombytes(f.read())
+
+    return doc_ids
+
+#==============================================================================================
+
+def get_searcher(docs_dataset, settings: Settings = DEFAULT_SETTINGS):
+    '''
+    Creates a Searcher for the index named settings.index_name.
+    The searcher also gets a doc_ids attribute: an array with our document id for each ColBERT passage id (see load_doc_ids),
+    so that search results can be mapped without accessing docs_dataset.
+    '''
     searcher = None
 
     with Run().context(RunConfig()):
-        searcher = Searcher(index=index_name, collection=docs_dataset["text"])
+        searcher = Searcher(index=settings.index_name, collection=docs_dataset["text"])
+
+    searcher.doc_ids = load_doc_ids(searcher.index, docs_dataset)
+
+    #The inverse mapping, used to re-rank our documents (see rerank)
+    searcher.passage_ids = {doc_id: passage_id for passage_id, doc_id in enumerate(searcher.doc_ids)}
 
     return searcher
 
 #==============================================================================================
 
-def search(searcher, docs_dataset, query, num_results: int):
-    
-    search_results = searcher.search(query, k=num_results)[0]
+def search(searcher, docs_dataset, query, num_results: int, with_scores: bool = False):
+    '''
+    Searches a query with ColBERT.
+    docs_dataset is no longer accessed, since the ids are mapped with the searcher's doc_ids array.
+
+    Returns:
+        - A list with the retrieved documents' IDs, sorted in descending order of score,
+        or a list of (document id, score) tuples if with_scores is True
+    '''
+
+    passage_ids, _, scores = searcher.search(query, k=num_results)
 
     #Maps the ids returned by colbert to our own ids
-    #Colbert ids are in search_results
-    #Our ids are stored in the dataset under "doc"
-    return list(map(lambda passage_id: docs_dataset[passage_id]["doc"], search_results))
\ No newline at end of file
+    doc_ids = [searcher.doc_ids[passage_id] for passage_id in passage_ids]
+
+    return list(zip(doc_ids, scores)) if with_scores else doc_ids
+
+#==============================================================================================
+
+def search_batch(searcher, docs_dataset, queries: list, num_results: int, batch_size: int = 64, with_scores: bool = False) -> list:
+    '''
+    Searches many queries with ColBERT, returning the same results as calling search for each query.
+    The queries are split into batches of batch_size, and the queries of each batch are encoded together in a single
+    forward pass, through Searcher.search_all.
+
+    Returns:
+        - A list with the results of each query, as returned by search
+    '''
+
+    results = []
+
+    for batch_start in range(0, len(queries), batch_size):
+        batch = queries[batch_start:batch_start + batch_size]
+
+        ranking = searcher.search_all({i: query for i, query in enumerate(batch)}, k=num_results).todict()
+
+        #Each ranked passage is a tuple of (passage_id, rank, score)
+        for i in range(len(batch)):
+            if with_scores:
+                results.append([(searcher.doc_ids[passage[0]], passage[2]) for passage in ranking[i]])
+            else:
+                results.append([searcher.doc_ids[passage[0]] for passage in ranking[i]])
+
+    return results
+
+#==============================================================================================
+
+def rerank(searcher, queries: list, candidates: list, num_results: int, batch_size: int = 64, with_scores: bool = False) -> list:
+    '''
+    Scores only the candidate documents of each query with ColBERT, instead of searching the whole index.
+    The queries are encoded in batches, as in search_batch, and the candidates' stored embeddings are scored
+    with late interaction (MaxSim), by passing their passage ids to Searcher.dense_search.
+
+    Parameters:
+        - queries: A list of queries
+        - candidates: A list with the candidate document ids of each query (e.g. the results of vsm.search_batch)
+        - num_results: The number of results returned for each query, at most the number of its candidates
+        - batch_size, with_scores: Same as in search_batch
+
+    Returns:
+        - A list with the results of each query, as returned by search
+    '''
+
+    results = []
+
+    for batch_start in range(0, len(queries), batch_size):
+        Q = searcher.encode(list(queries[batch_start:batch_start + batch_size]))
+
+        for i, doc_ids in enumerate(candidates[batch_start:batch_start + batch_size]):
+            passage_ids = [searcher.passage_ids[doc_id] for doc_id in doc_ids if doc_id in searcher.passage_ids]
+
+            if not passage_ids:
+                results.append([])
+                continue
+
+            passage_ids, _, scores = searcher.dense_search(Q[i:i+1], k=min(num_results, len(passage_ids)), pids=passage_ids)
+
+            doc_ids = [searcher.doc_ids[passage_id] for passage_id in passage_ids]
+
+            results.append(list(zip(doc_ids, scores)) if with_scores else doc_ids)
+
+    return results
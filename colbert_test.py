@@ -24,13 +24,13 @@ if __name__ == "__main__":
     avg_dcg = [0 for i in range(0,queries_dataset.num_rows)]
     avg_idcg = [0 for i in range(0,queries_dataset.num_rows)]
 
-    for q in queries_dataset:
+    answers = colbert_helper.search_batch(searcher, docs_dataset, queries_dataset["query"], 20)
+
+    for q, answer in zip(queries_dataset, answers):
         id = q["qid"]
         query = q["query"]
         relevant = q["answers"]["docs"]
 
-        answer = colbert_helper.search(searcher, docs_dataset, query, 20)
-
         #Metrics
         #====================================================================================
 
@@ -0,0 +1,200 @@
+'''
+Compression of sorted integer lists (postings lists and word positions)
+'''
+
+import numpy
+
+#==============================================================================================
+
+#Number of postings in each block. Each block can be decoded on its own, and has a skip pointer
+BLOCK_SIZE = 128
+
+#==============================================================================================
+
+def delta_encode(values) -> list:
+    '''
+    Replaces each value of a sorted list with its difference (gap) from the previous one.
+    The first value is kept as it is.
+    '''
+    prev = 0
+    gaps = []
+
+    for v in values:
+        gaps.append(v - prev)
+        prev = v
+
+    return gaps
+
+#==============================================================================================
+
+def delta_decode(gaps, base = 0) -> list:
+    '''
+    Reverses delta_encode. base is added to the first gap.
+    '''
+    values = []
+
+    for g in gaps:
+        base += g
+        values.append(base)
+
+    return values
+
+#==============================================================================================
+
+def vbyte_encode(values, out: bytearray):
+    '''
+    Appends the Variable-Byte encoding of values to out.
+    Each value is split into groups of 7 bits, from least to most significant, one group per byte.
+    The high bit is set on the last byte of each value.
+    '''
+    for v in values:
+        while v >= 128:
+            out.append(v & 127)
+            v >>= 7
+
+        out.append(v | 128)
+
+#==============================================================================================
+
+def vbyte_decode(data, offset: int, count: int):
+    '''
+    Decodes count values encoded by vbyte_encode, starting at data[offset].
+
+    Returns:
+    - The list of values
+    - The offset right after the last decoded byte
+    '''
+    values = []
+
+    while len(values) < count:
+        v = 0
+        shift = 0
+
+        while True:
+            b = data[offset]
+            offset += 1
+
+            if b & 128:
+                values.append(v | ((b & 127) << shift))
+                break
+
+            v |= b << shift
+            shift += 7
+
+    return values, offset
+
+#==============================================================================================
+
+def bitpack_encode(values, out: bytearray):
+    '''
+    Appends values to out using the same number of bits for all of them (the bits of the largest value).
+    The first byte stores the number of bits, followed by the packed values.
+    '''
+    width = max(max(values, default=0).bit_length(), 1)
+
+    packed = 0
+
+    for i, v in enumerate(values):
+        packed |= v << (i*width)
+
+    out.append(width)
+    out += packed.to_bytes((len(values)*width + 7) // 8, "little")
+
+#==============================================================================================
+
+def bitpack_decode(data, offset: int, count: int):
+    '''
+    Decodes count values encoded by bitpack_encode, starting at data[offset].
+
+    Returns:
+    - The list of values
+    - The offset right after the last decoded byte
+    '''
+    width = data[offset]
+    end = offset + 1 + (count*width + 7) // 8
+
+    packed = int.from_bytes(data[offset + 1:end], "little")
+    mask = (1 << width) - 1
+
+    return [(packed >> (i*width)) & mask for i in range(count)], end
+
+#==============================================================================================
+
+def vbyte_decode_array(data, start: int, end: int):
+    '''
+    Decodes all the values encoded by vbyte_encode in data[start:end] at once, with numpy instead of a loop per byte.
+
+    Returns a numpy array of the values
+    '''
+    groups = numpy.frombuffer(data, dtype=numpy.uint8, count=end - start, offset=start).astype(numpy.int64)
+
+    #Usually, every value fits in a single byte
+    if groups.min(initial=128) >= 128:
+        return groups & 127
+
+    #Each value starts after the last byte of the previous one (the bytes with the high bit set)
+    value_starts = numpy.flatnonzero(numpy.concatenate(([True], groups[:-1] >= 128)))
+    value_lengths = numpy.diff(numpy.append(value_starts, len(groups)))
+
+    #The position of each byte in its value gives the shift of its 7 bits
+    shifts = 7*(numpy.arange(len(groups)) - numpy.repeat(value_starts, value_lengths))
+
+    return numpy.add.reduceat((groups & 127) << shifts, value_starts)
+
+#==============================================================================================
+
+def bitpack_decode_array(data, offset: int, count: int):
+    '''
+    Same as bitpack_decode, but unpacks the bits with numpy.
+
+    Returns:
+    - A numpy array of the values
+    - The offset right after the last decoded byte
+    '''
+    width = data[offset]
+    size = (count*width + 7) // 8
+
+    bits = numpy.unpackbits(numpy.frombuffer(data, dtype=numpy.uint8, count=size, offset=offset + 1), bitorder="little")[:count*width]
+    values = bits.reshape(count, width).astype(numpy.int64) @ (1 << numpy.arange(width, dtype=numpy.int64))
+
+    return values, offset + 1 + size
+
+#==============================================================================================
+
+CODECS = {
+    "vbyte": (vbyte_encode, vbyte_decode),
+    "bitpack": (bitpack_encode, bitpack_decode)
+}
+
+#==============================================================================================
+
+def encode_block(doc_ids, freqs, base: int, codec: str, out: bytearray):
+    '''
+    Appends a block of postings to out.
+    The document ids are stored as gaps, where the first gap is taken from base (the last document id of the previous block),
+    followed by the frequencies.
+    '''
+    encode = CODECS[codec][0]
+
+    gaps = delta_encode(doc_ids)
+    gaps[0] -= base
+
+    encode(gaps, out)
+    encode(freqs, out)
+
+#==============================================================================================
+
+def decode_block(data, offset: int, count: int, base: int, codec: str):
+    '''
+    Decodes a block of count postings written by encode_block, starting at data[offset].
+
+    Returns:
+    - The document ids
+    - The frequencies
+    '''
+    decode = CODECS[codec][1]
+
+    gaps, offset = decode(data, offset, count)
+    freqs, _ = decode(data, offset, count)
+
+    return delta_decode(gaps, base), freqs
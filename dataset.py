@@ -8,8 +8,13 @@ sys.path.insert(0, '/home/zoukos/ceid/Information_Retrieval/ColBERT/')
 import json
 import re
 import os
-import pandas as pd
-from datasets import load_dataset
+
+#pandas and datasets are imported by the functions that use them, since they take a while to import
+
+#==============================================================================================
+
+#The preprocessed documents, one json object per line (see collection_preprocessing)
+docs_file = "json_docs/docs.jsonl"
 
 #==============================================================================================
 
@@ -64,7 +69,8 @@ def collection_preprocessing(docs_path, queries_path):
     queries_path (e.g. proj/cfquery_detailed) should lead to the DETAILED query list.
     Creates two directories json_docs and json_queries.
 
-    In json_docs, each document is represented as a json file containing:
+    In json_docs, a single file called docs.jsonl (docs_file) contains all documents in order of id,
+    one json object per line (see write_documents), containing:
     - doc: The document id, from 1 to 1239
     - text: The actual contents of the document
 
@@ -81,25 +87,7 @@ def collection_preprocessing(docs_path, queries_path):
 
     #Documents
     #===============================================================================
-    for i in range(1, 1240):
-        try:
-            f = open(docs_path + f"{i:05}")
-
-            text = ""
-
-            for word in f:
-                text += word[:-1] + " "
-                #print(word)
-
-            f.close()
-
-            json_obj = {"doc": i, "text": text[:-1]}
-
-            with open("json_docs/" + f"{i:05}" + ".json", "w") as json_file:
-                json.dump(json_obj, json_file, indent="\t")
-
-        except FileNotFoundError as ferr:
-            continue
+    write_documents(docs_path, docs_file)
 
     #Queries
     #===============================================================================
@@ -135,10 +123,94 @@ def collection_preprocessing(docs_path, queries_path):
 
 #==============================================================================================
 
+def document_ids(docs_path):
+    '''
+    Returns the ids of the documents in docs_path, a directory with one file per document named by its id (e.g. 00001),
+    in ascending order
+    '''
+    return sorted(int(name) for name in os.listdir(docs_path) if name.isdigit())
+
+#==============================================================================================
+
+def write_documents(docs_path, out_path, doc_ids = None):
+    '''
+    Streams the documents in docs_path into out_path, one json object {"doc": id, "text": contents} per line.
+    The words of each document (one per line in the original files) are joined with single spaces, so the words
+    and their positions can be recovered with text.split(" ").
+    By default every document in docs_path is written, in order of id (see document_ids). Documents that don't exist are skipped.
+
+    Only one document is in memory at a time. The file is written under a temporary name and renamed when complete,
+    so an interrupted run never leaves a partial file behind.
+    '''
+
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+
+    if doc_ids is None:
+        doc_ids = document_ids(docs_path)
+
+    with open(out_path + ".tmp", "w") as out:
+        for i in doc_ids:
+            try:
+                with open(docs_path + f"{i:05}") as f:
+                    text = " ".join(line.rstrip("\n") for line in f)
+            except FileNotFoundError:
+                continue
+
+            out.write(json.dumps({"doc": i, "text": text}) + "\n")
+
+    os.replace(out_path + ".tmp", out_path)
+
+#==============================================================================================
+
+def read_documents(path = docs_file, start = 0, end = None):
+    '''
+    Yields the (id, text) of each document in a file created by write_documents, one at a time.
+    If end is set, only the lines that start from byte start up to (not including) byte end are read,
+    so that separate processes can read separate parts of the file (see split_documents)
+    '''
+
+    with open(path, "rb") as f:
+        f.seek(start)
+
+        for line in f:
+            if end is not None and start >= end:
+                break
+
+            start += len(line)
+
+            doc = json.loads(line)
+            yield doc["doc"], doc["text"]
+
+#==============================================================================================
+
+def split_documents(path = docs_file, count = 1):
+    '''
+    Splits a file created by write_documents into at most count parts of about the same size, without reading it.
+
+    Returns a list of (start, end) byte offsets for read_documents. Every part starts at the beginning of a line
+    '''
+
+    size = os.path.getsize(path)
+    offsets = [0]
+
+    with open(path, "rb") as f:
+        for i in range(1, count):
+            #Skip to the start of the first line after the (i*size/count)-th byte
+            f.seek(i*size//count - 1)
+            f.readline()
+            offsets.append(min(f.tell(), size))
+
+    offsets.append(size)
+    offsets = sorted(set(offsets))
+
+    return list(zip(offsets, offsets[1:]))
+
+#==============================================================================================
+
 def load_datasets(docs_path, queries_path):
     '''
     Loads the two preprocessed datasets from the existing json_queries/ json_docs directories.
-    If these directories don't exist, they will be created from the documents in docs_path and the DETAILED query list pointed to by queries_path
+    If their files (json_queries/queries.json, docs_file) don't exist, they will be created from the documents in docs_path and the DETAILED query list pointed to by queries_path
 
     Returns:
     - docs_dataset
@@ -156,18 +228,36 @@ def load_datasets(docs_path, queries_path):
     #       ["docs"]: A list relevant documents to this query
     #       ["scores"]: A list of scores, each represented as a 4-digit string, for the respective relevant documents
 
-    if not (os.path.exists("json_queries/") and os.path.exists("json_docs/")):
+    if not (os.path.exists("json_queries/queries.json") and os.path.exists(docs_file)):
         print("Preprocessing collection...\n")
         collection_preprocessing(docs_path, queries_path)
 
-    queries_dataset = load_dataset("json_queries")["train"]
-    docs_dataset = load_dataset("json_docs")["train"]
+    from datasets import load_dataset
+
+    queries_dataset = load_dataset("json", data_files="json_queries/queries.json")["train"]
+    docs_dataset = load_dataset("json", data_files=docs_file)["train"]
 
     return docs_dataset, queries_dataset
 
 #==============================================================================================
 
+def load_queries(docs_path, queries_path):
+    '''
+    Loads only the preprocessed queries, as a list of dictionaries with the same structure as the rows of queries_dataset (see load_datasets).
+    Unlike load_datasets, it doesn't need the datasets library, so it is much faster when the documents are not needed.
+    '''
+
+    if not (os.path.exists("json_queries/queries.json") and os.path.exists(docs_file)):
+        print("Preprocessing collection...\n")
+        collection_preprocessing(docs_path, queries_path)
+
+    with open("json_queries/queries.json", "r") as f:
+        return json.load(f)
+
+#==============================================================================================
+
 def excel(filename, dict_data, query_ids = None):
+    import pandas as pd
 
     if query_ids is None:
         query_ids = range(1,21)
@@ -0,0 +1,121 @@
+'''
+Hybrid retrieval: the Vector Space Model generates candidates and ColBERT scores only those candidates
+'''
+
+import vsm
+
+#colbert_helper (torch and ColBERT) is imported by search, so that the fusion functions can be used without it
+
+#==============================================================================================
+
+#Methods of combining the VSM and ColBERT results, used by search
+#- rerank: The candidates are ordered by their ColBERT score alone
+#- rrf: Reciprocal rank fusion of the two rankings of the candidates
+#- score: Weighted sum of the min-max normalized scores of the candidates
+HYBRID_METHODS = ["rerank", "rrf", "score"]
+
+#==============================================================================================
+
+def reciprocal_rank_fusion(rankings: list, num_results: int, k: int = 60) -> list:
+    '''
+    Combines many rankings of the same query. Each document gets the sum of 1/(k + rank) over the rankings it appears in.
+
+    Parameters:
+        - rankings: A list of rankings, each a list of document ids sorted in descending order of score
+        - k: Lowers the weight of the top ranks, so that a single ranking can't dominate the result
+
+    Returns:
+        - A list with the num_results document ids with the highest fused score. Ties are broken by document id
+    '''
+
+    fused = dict() #id: int => fused score: float
+
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            fused[doc] = fused.get(doc, 0) + 1/(k + rank)
+
+    return sorted(fused, key=lambda doc: (-fused[doc], doc))[:num_results]
+
+#==============================================================================================
+
+def score_fusion(rankings: list, num_results: int, weights: list = None) -> list:
+    '''
+    Combines many rankings of the same query by their scores.
+    The scores of each ranking are min-max normalized to [0, 1], since every model scores on its own scale,
+    and each document gets their weighted sum. Documents missing from a ranking get 0 from it.
+
+    Parameters:
+        - rankings: A list of rankings, each a list of (document id, score) tuples
+        - weights: The weight of each ranking. All rankings weigh the same by default
+
+    Returns:
+        - A list with the num_results document ids with the highest fused score. Ties are broken by document id
+    '''
+
+    if weights is None:
+        weights = [1]*len(rankings)
+
+    fused = dict() #id: int => fused score: float
+
+    for ranking, weight in zip(rankings, weights):
+        if not ranking:
+            continue
+
+        scores = [score for _, score in ranking]
+        low, high = min(scores), max(scores)
+
+        for doc, score in ranking:
+            normalized = (score - low)/(high - low) if high > low else 1
+            fused[doc] = fused.get(doc, 0) + weight*normalized
+
+    return sorted(fused, key=lambda doc: (-fused[doc], doc))[:num_results]
+
+#==============================================================================================
+
+def search(index, doc_norms: dict, max_doc_freq: dict, searcher, queries: list, num_results: int, weighting_method: int,
+           num_candidates: int = 100, method: str = "rerank", batch_size: int = 64) -> list:
+    '''
+    Searches many queries with the hybrid pipeline:
+    1. The top num_candidates documents of each query are retrieved with vsm.search_batch
+    2. ColBERT scores only these candidates (colbert_helper.rerank), so its cost no longer depends on the size of the collection
+    3. The candidates are ordered according to method (see HYBRID_METHODS)
+
+    Parameters:
+        - index, doc_norms, max_doc_freq, weighting_method: The VSM index, as in vsm.search
+        - searcher: The ColBERT searcher, returned by colbert_helper.get_searcher
+        - num_candidates: The max number of VSM candidates of each query. Documents outside them can't be returned,
+        and neither can documents without any query term, so a query can get fewer than num_results results
+        - batch_size: The number of queries ColBERT encodes together
+        - The rest are the same as in vsm.search_batch
+
+    Returns:
+        - A list with the results of each query, as returned by vsm.search
+    '''
+
+    import colbert_helper
+
+    if method not in HYBRID_METHODS:
+        raise ValueError(f"Unknown hybrid method: {method}. Available methods: {HYBRID_METHODS}")
+
+    num_candidates = max(num_candidates, num_results)
+
+    candidates = vsm.search_batch(index, doc_norms, max_doc_freq, queries, num_candidates, weighting_method, with_scores=True)
+
+    #search_batch pads the results with documents that don't match the query. They are not candidates
+    candidates = [[(doc, score) for doc, score in ranking if score > 0] for ranking in candidates]
+
+    #Fusion needs the ColBERT score of every candidate, re-ranking only the top ones
+    reranked = colbert_helper.rerank(searcher, queries, [[doc for doc, _ in ranking] for ranking in candidates],
+                                     num_results if method == "rerank" else num_candidates, batch_size=batch_size, with_scores=True)
+
+    results = []
+
+    for vsm_ranking, colbert_ranking in zip(candidates, reranked):
+        if method == "rerank":
+            results.append([doc for doc, _ in colbert_ranking])
+        elif method == "rrf":
+            results.append(reciprocal_rank_fusion([[doc for doc, _ in vsm_ranking], [doc for doc, _ in colbert_ranking]], num_results))
+        else:
+            results.append(score_fusion([vsm_ranking, colbert_ranking], num_results))
+
+    return results
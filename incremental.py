@@ -0,0 +1,237 @@
+'''
+Incremental updates of the Vector Space Model index
+'''
+
+import threading
+
+import vsm
+
+#==============================================================================================
+
+class IncrementalIndex:
+    '''
+    A Vector Space Model index that supports adding, deleting and updating single documents without re-reading the collection.
+
+    The index is made of a base segment (the index returned by vsm.finalize_index) and a delta segment:
+    - Added documents are read right away and kept in the delta segment, until the next merge
+    - Deleted documents are tombstoned. They are filtered out of the search results immediately, and removed at the next merge
+    - An updated document is deleted and then added again
+
+    Merging patches the postings of the affected terms, the max frequencies and the forward index,
+    and then recalculates the norms and weights from the postings in memory.
+    Since the tf-idf weights depend on the number of documents and every document frequency, this is the only way to keep them exact.
+    Merging happens when merge() is called, or periodically in a background thread if merge_interval is set.
+    '''
+
+    def __init__(self, docs_path, weighting_method, merge_interval = None, query_cache = None):
+        '''
+        Indexes the documents in docs_path.
+
+        - docs_path: A path (e.g. proj/docs/) to a directory will all the documents
+        - weighting_method: One of the scorers in scoring.SCORERS
+        - merge_interval: If set, the delta segment is merged into the base segment every merge_interval seconds
+        - query_cache: If set (a cache.QueryCache), search results are cached there. It is invalidated whenever the results could change
+        '''
+
+        self.docs_path = docs_path
+        self.weighting_method = weighting_method
+        self.query_cache = query_cache
+
+        self.postings = dict() #term: str => [postings]
+        self.max_doc_freq = dict() #id: int => max_freq: int
+
+        #The terms of each document, so that a deleted document's postings can be found without scanning the whole index.
+        #Every document is in it, even without terms, so len(doc_terms) is the number of documents N, as in vsm.write_index
+        self.doc_terms = dict() #id: int => [terms]
+
+        for doc_id, words in vsm.read_words(docs_path):
+            doc_postings = vsm.document_postings(doc_id, words)
+
+            for term, posting in doc_postings.items():
+                self.postings.setdefault(term, []).append(posting)
+
+            if doc_postings:
+                self.max_doc_freq[doc_id] = max(p[1] for p in doc_postings.values())
+
+            self.doc_terms[doc_id] = list(doc_postings)
+
+        self.delta = dict() #id: int => (partial index, max frequency)
+        self.deleted = set()
+
+        #The delta segment and the tombstones that the running merge consumes, still pending until it finishes
+        self.merging_delta = set()
+        self.merging_deleted = set()
+
+        self.lock = threading.RLock() #Guards the segments. Not held while a merge recalculates the weights
+        self.merge_lock = threading.Lock() #Only one merge runs at a time
+
+        self.index, self.doc_norms = vsm.finalize_index(self.postings, self.max_doc_freq, len(self.doc_terms), weighting_method)
+
+        self.stop_merging = threading.Event()
+        self.merge_thread = None
+
+        if merge_interval is not None:
+            self.merge_thread = threading.Thread(target=self.merge_periodically, args=(merge_interval,), daemon=True)
+            self.merge_thread.start()
+
+    #==========================================================================================
+
+    def add_document(self, doc_id: int):
+        '''
+        Reads document doc_id from docs_path and adds it to the delta segment.
+        If the document is already in the index, it gets replaced.
+        '''
+
+        doc_index, doc_max_freq, N = vsm.index_documents(self.docs_path, [doc_id])
+
+        if N == 0:
+            raise FileNotFoundError(f"Document {doc_id} does not exist in {self.docs_path}")
+
+        with self.lock:
+            self.delete_document(doc_id)
+            self.delta[doc_id] = (doc_index, doc_max_freq.get(doc_id, 0))
+
+    #==========================================================================================
+
+    def delete_document(self, doc_id: int):
+        '''
+        Removes document doc_id from the delta segment, or tombstones it if it is in the base segment
+        '''
+
+        with self.lock:
+            self.delta.pop(doc_id, None)
+
+            if (doc_id in self.doc_terms or doc_id in self.merging_delta) and doc_id not in self.deleted:
+                self.deleted.add(doc_id)
+
+                if self.query_cache is not None:
+                    self.query_cache.invalidate()
+
+    #==========================================================================================
+
+    def update_document(self, doc_id: int):
+        '''
+        Re-reads document doc_id from docs_path, replacing its previous version
+        '''
+
+        self.add_document(doc_id)
+
+    #==========================================================================================
+
+    def merge(self):
+        '''
+        Merges the delta segment and the tombstones into the base segment, and recalculates the norms and weights.
+
+        The new base segment is built on copies, without holding the lock, so searches and updates are not blocked in the meantime.
+        Documents added or deleted while a merge runs are kept for the next one.
+        '''
+
+        with self.merge_lock:
+            with self.lock:
+                if not (self.delta or self.deleted):
+                    return
+
+                delta, deleted = self.delta, self.deleted
+                self.delta, self.deleted = dict(), set()
+                self.merging_delta, self.merging_deleted = set(delta), deleted
+
+                #New lists are created for every changed term, so the copies don't share any list that gets modified
+                postings, doc_terms, max_doc_freq = dict(self.postings), dict(self.doc_terms), dict(self.max_doc_freq)
+
+            #Deletions
+            #=================================================================================
+            for doc_id in deleted:
+                #A document can be deleted again while the merge that removes it is running
+                for term in doc_terms.pop(doc_id, []):
+                    term_postings = [p for p in postings[term] if p[0] != doc_id]
+
+                    if term_postings:
+                        postings[term] = term_postings
+                    else:
+                        del postings[term]
+
+                max_doc_freq.pop(doc_id, None)
+
+            #Additions
+            #=================================================================================
+            added = dict() #term: str => [postings]
+
+            for doc_id, (doc_index, max_freq) in delta.items():
+                for term, term_postings in doc_index.items():
+                    added.setdefault(term, []).extend(term_postings)
+
+                doc_terms[doc_id] = list(doc_index)
+
+                if doc_index:
+                    max_doc_freq[doc_id] = max_freq
+
+            for term, term_postings in added.items():
+                postings[term] = sorted(postings.get(term, []) + term_postings, key=lambda p: p[0])
+
+            index, doc_norms = vsm.finalize_index(postings, max_doc_freq, len(doc_terms), self.weighting_method)
+
+            with self.lock:
+                self.postings, self.doc_terms, self.max_doc_freq = postings, doc_terms, max_doc_freq
+                self.index, self.doc_norms = index, doc_norms
+                self.merging_delta, self.merging_deleted = set(), set()
+
+                if self.query_cache is not None:
+                    self.query_cache.invalidate()
+
+    #==========================================================================================
+
+    def merge_periodically(self, merge_interval):
+        '''
+        Runs in the background thread, merging the delta segment every merge_interval seconds until close() is called
+        '''
+
+        while not self.stop_merging.wait(merge_interval):
+            self.merge()
+
+    #==========================================================================================
+
+    def close(self):
+        '''
+        Stops the background merging, after merging any pending changes
+        '''
+
+        self.stop_merging.set()
+
+        if self.merge_thread is not None:
+            self.merge_thread.join()
+
+        self.merge()
+
+    #==========================================================================================
+
+    def search(self, query: str, num_results: int) -> list:
+        '''
+        Searches the base segment with vsm.score_taat, leaving out tombstoned documents.
+        Documents in the delta segment become searchable after the next merge.
+
+        Returns:
+            - A list with the retrieved documents' IDs, sorted in descending order of similarity score
+        '''
+
+        if self.query_cache is not None:
+            return self.query_cache.search("vsm", query, num_results, lambda: self.search_uncached(query, num_results))
+
+        return self.search_uncached(query, num_results)
+
+    #==========================================================================================
+
+    def search_uncached(self, query: str, num_results: int) -> list:
+        '''
+        Same as search, without going through the query cache
+        '''
+
+        with self.lock:
+            index, doc_norms, deleted = self.index, self.doc_norms, self.deleted | self.merging_deleted
+
+        scores = vsm.score_taat(index, doc_norms, query, self.weighting_method)
+
+        if deleted:
+            scores = {doc: score for doc, score in scores.items() if doc not in deleted}
+            doc_norms = {doc: norm for doc, norm in doc_norms.items() if doc not in deleted}
+
+        return vsm.top_results(scores, doc_norms, num_results)
@@ -1,186 +1,190 @@
-import dataset
-import vsm
-import colbert_helper
-import metrics
-
-import os
-import shutil
-
-if __name__ == "__main__":
+'''
+Evaluates the retrievers on our collection.
 
-    #Set to true if ColBERT index doesn't already exist
-    index_first = False
+Usage:
+    python main.py [--retrievers vsm colbert hybrid] [--metrics precision fscore mrr map ndcg diagram]
 
-    #Initialization
-    #==============================================================================================
+Only the modules of the selected stages are imported, so e.g. a Vector Space Model run never imports torch or ColBERT.
+'''
 
-    #Name of the index that ColBERT will use for searching (will be recreated if index_first = True)
-    colbert_helper.index_name = "index_1"
+import argparse
+import os
 
-    #The number of results you want each search to return
-    num_results = 20
+import dataset
 
-    #Determines which implementation of TF-IDF weights is used
-    vsm_weighting_method = 0
+#The retrievers that can be evaluated. hybrid needs the VSM index and ColBERT, but not their own results
+RETRIEVERS = ["vsm", "colbert", "hybrid"]
 
-    #Change depending on where the original documents and queries are stored
-    path_to_docs = "original_dataset/docs/"
-    path_to_cfquery_detailed = "original_dataset/cfquery_detailed"
+#The metrics that are printed and written to Excel. Every metric is always written to results/report.json and .csv
+#precision also includes recall
+METRICS = ["precision", "fscore", "mrr", "map", "ndcg", "diagram"]
 
-    docs_dataset, queries_dataset = dataset.load_datasets(path_to_docs, path_to_cfquery_detailed)
+if __name__ == "__main__":
 
-    num_queries = queries_dataset.num_rows
-    num_docs = docs_dataset.num_rows
+    parser = argparse.ArgumentParser(description="Evaluate the Vector Space Model, ColBERT and the hybrid retriever")
+    parser.add_argument("--retrievers", nargs="+", choices=RETRIEVERS, default=RETRIEVERS, help="The retrievers that are evaluated")
+    parser.add_argument("--metrics", nargs="+", choices=METRICS, default=METRICS, help="The metrics that are calculated")
+    parser.add_argument("--num-results", type=int, default=20, help="The number of results each search returns")
+    parser.add_argument("--docs", default="original_dataset/docs/", help="Directory with the original documents")
+    parser.add_argument("--queries", default="original_dataset/cfquery_detailed", help="The detailed query list")
+    parser.add_argument("--weighting-method", type=int, default=0, help="VSM weighting method (0: tfc, 1: txc, 2: BM25, 3: BM25+, see scoring.SCORERS)")
+    parser.add_argument("--vsm-index", default="results/inverted_index.bin", help="Binary VSM index, created if it doesn't exist and rebuilt when the documents or the index settings change")
+    parser.add_argument("--codec", default="none", choices=["none", "vbyte", "bitpack"],
+                        help="Compression of the VSM postings. vbyte and bitpack make the index less than half as large, but searches about 1.5 times slower")
+    parser.add_argument("--index-processes", type=int, default=1, help="Processes used to build the VSM index. Worth raising only for collections much larger than ours")
+    parser.add_argument("--colbert-index", default="index_1", help="Name of the ColBERT index")
+    parser.add_argument("--index-first", action="store_true", help="(Re)create the ColBERT index before searching")
+    parser.add_argument("--cpu", action="store_true", help="Create the ColBERT index on the CPU with every core, resuming interrupted runs")
+    parser.add_argument("--hybrid-method", default="rerank", choices=["rerank", "rrf", "score"],
+                        help="How the hybrid retriever orders the VSM candidates (see hybrid.HYBRID_METHODS)")
+    parser.add_argument("--hybrid-candidates", type=int, default=100, help="The number of VSM candidates ColBERT scores per query")
+    parser.add_argument("--significance", action="store_true", help="Test every pair of systems for significant differences in MAP and NDCG")
+    parser.add_argument("--permutations", type=int, default=100000, help="Number of permutations of the randomization test")
+    parser.add_argument("--show-plots", action="store_true", help="Show the precision-recall diagrams on the screen, on top of saving them")
+    parser.add_argument("--plots-pdf", action="store_true", help="Also save all precision-recall diagrams as one multi-page PDF")
+    parser.add_argument("--plots-grid", action="store_true", help="Also combine all precision-recall diagrams into one grid image")
+    args = parser.parse_args()
 
-    if index_first:
-        colbert_helper.create_index(docs_dataset)
+    #Initialization
+    #==============================================================================================
+    num_results = args.num_results
+    vsm_weighting_method = args.weighting_method
+    vsm_codec = None if args.codec == "none" else args.codec
 
+    queries_dataset = dataset.load_queries(args.docs, args.queries)
+    queries = [query["query"] for query in queries_dataset]
+    query_ids = [query["qid"] for query in queries_dataset]
 
     #Results path
     os.makedirs("results", exist_ok=True)
 
+    results = dict() #retriever name => results of each query
+
     #Vector Space Model
     #==============================================================================================
-    vsm_results = []
+    if "vsm" in args.retrievers or "hybrid" in args.retrievers:
+        import vsm
 
-    index, doc_norms, max_doc_freq = vsm.write_index(path_to_docs, vsm_weighting_method)
+        #The saved index is only reused if it was built the same way, from the current documents
+        vsm_source = vsm.index_source(dataset.docs_file)
 
-    for q in queries_dataset:
+        if vsm.index_header(args.vsm_index) == (vsm_weighting_method, vsm_codec, vsm_source):
+            index, doc_norms, max_doc_freq = vsm.load_index(args.vsm_index)
+        else:
+            #Indexed from the preprocessed documents, in a single pass over one file
+            index, doc_norms, max_doc_freq = vsm.write_index(dataset.docs_file, vsm_weighting_method, compact=True, codec=vsm_codec, processes=args.index_processes)
+            vsm.save_index(args.vsm_index, index, doc_norms, max_doc_freq, vsm_weighting_method, vsm_source)
 
-        search_results = vsm.search(index, doc_norms, max_doc_freq, q["query"], num_results, vsm_weighting_method)
-        vsm_results.append(search_results)
+    if "vsm" in args.retrievers:
+        #All queries are scored together
+        results["Vector Space"] = vsm.search_batch(index, doc_norms, max_doc_freq, queries, num_results, vsm_weighting_method)
 
     #Colbert
     #==============================================================================================
-    colbert_results = []
-
-    searcher = colbert_helper.get_searcher(docs_dataset)
-
-    for q in queries_dataset:
-
-        search_results = colbert_helper.search(searcher, docs_dataset, q["query"], num_results)
-        colbert_results.append(search_results)
-
-    #Metrics
-    #==============================================================================================
-        
-    #Results
-    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    print("Vector Space Model Results\n=======================================================")
-    for i, results in enumerate(vsm_results):
-        print(f"Query {i+1}: {results}")
+    if "colbert" in args.retrievers or "hybrid" in args.retrievers:
+        import colbert_helper
 
-    print("\nColBERT Results\n=======================================================")
-    for i, results in enumerate(colbert_results):
-        print(f"Query {i+1}: {results}")
+        if args.cpu:
+            colbert_settings = colbert_helper.cpu_settings(index_name=args.colbert_index)
+        else:
+            colbert_settings = colbert_helper.Settings(index_name=args.colbert_index)
 
-    print("")
+        docs_dataset, _ = dataset.load_datasets(args.docs, args.queries)
 
-    #Precision-Recall
-    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    precision = {"Vector Space": [], "ColBERT": []}
-    recall = {"Vector Space": [], "ColBERT": []}
+        if args.index_first:
+            colbert_helper.create_index(docs_dataset, colbert_settings)
 
-    print("Precision-Recall for Vector Space Model\n=======================================================\n")
+        searcher = colbert_helper.get_searcher(docs_dataset, colbert_settings)
 
-    for i, results in enumerate(vsm_results):
-        p = f"{round(metrics.precision(results, queries_dataset[i]['answers']['docs']), 3):.03f}"
-        r = f"{round(metrics.recall(results, queries_dataset[i]['answers']['docs']), 3):.03f}"
+    if "colbert" in args.retrievers:
+        #Queries are encoded in batches
+        results["ColBERT"] = colbert_helper.search_batch(searcher, docs_dataset, queries, num_results)
 
-        precision["Vector Space"].append(p)
-        recall["Vector Space"].append(r)
+    #Hybrid
+    #==============================================================================================
+    if "hybrid" in args.retrievers:
+        import hybrid
 
-        print(f"Query {i+1}\n-------------------")
+        results["Hybrid"] = hybrid.search(index, doc_norms, max_doc_freq, searcher, queries, num_results, vsm_weighting_method,
+                                          num_candidates=args.hybrid_candidates, method=args.hybrid_method)
 
-        print(f"Precision: {p}")
-        print(f"Recall: {r}\n")
+    #Metrics
+    #==============================================================================================
+    import metrics
 
-    print("Precision-Recall for ColBERT\n=======================================================\n")
+    #Results
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    for name, system_results in results.items():
+        print(f"{name} Results\n=======================================================")
+        for i, query_results in enumerate(system_results):
+            print(f"Query {i+1}: {query_results}")
 
-    for i, results in enumerate(colbert_results):
-        p = f"{round(metrics.precision(results, queries_dataset[i]['answers']['docs']), 3):.03f}"
-        r = f"{round(metrics.recall(results, queries_dataset[i]['answers']['docs']), 3):.03f}"
+        print("")
 
-        precision["ColBERT"].append(p)
-        recall["ColBERT"].append(r)
+    #Every metric of every system, calculated in one pass with the relevance judgements materialized once
+    report = metrics.report(results, metrics.qrels_arrays(queries_dataset), query_ids)
 
-        print(f"Query {i+1}\n-------------------")
+    #Paired tests on the per query metrics, added to the report
+    if args.significance:
+        import significance
 
-        print(f"Precision: {p}")
-        print(f"Recall: {r}\n")
+        report["significance"] = significance.compare(report, permutations=args.permutations)
 
+    metrics.write_report(report, "results/report")
 
-    dataset.excel("results/precision.xlsx", precision)
-    dataset.excel("results/recall.xlsx", recall)
+    systems = report["systems"]
 
-    #F-Score
+    #Per query metrics
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    fscore = {"Vector Space": [], "ColBERT": []}
+    #Each one is printed and written to results/<name>.xlsx if its command line metric is selected
+    per_query = [("precision", "precision", "Precision"), ("precision", "recall", "Recall"), ("fscore", "fscore", "F-Score"), ("ndcg", "ndcg", "NDCG")]
 
-    print("\nF-Score for Vector Space Model\n=======================================================")
+    for option, metric, title in per_query:
+        if option not in args.metrics:
+            continue
 
-    for i, results in enumerate(vsm_results):
-        f = f"{round(metrics.fscore(results, queries_dataset[i]['answers']['docs']), 3):.03f}"
-        fscore["Vector Space"].append(f)
-        print(f"F-Score for Query {i+1}: {f}")
+        table = {name: [f"{value:.03f}" for value in system["per_query"][metric]] for name, system in systems.items()}
 
-    print("\nF-Score for ColBERT\n=======================================================")
+        for name, values in table.items():
+            print(f"{title} for {name}\n=======================================================")
 
-    for i, results in enumerate(colbert_results):
-        f = f"{round(metrics.fscore(results, queries_dataset[i]['answers']['docs']), 3):.03f}"
-        fscore["ColBERT"].append(f)
-        print(f"F-Score for Query {i+1}: {f}")
+            for query_id, value in zip(query_ids, values):
+                print(f"{title} for Query {query_id}: {value}")
 
-    dataset.excel("results/fscore.xlsx", fscore)
+            print("")
 
-    print("")
+        dataset.excel(f"results/{metric}.xlsx", table, query_ids)
 
-    #Mean Reciprocal Rank
+    #Means
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    print(f"Mean Reciprocal Rank for Vector Space Model: {round(metrics.mean_reciprocal_rank(vsm_results, queries_dataset), 3):03}")
-    print(f"Mean Reciprocal Rank for ColBERT: {round(metrics.mean_reciprocal_rank(colbert_results, queries_dataset), 3):03}")
+    for name, system in systems.items():
+        if "mrr" in args.metrics:
+            print(f"Mean Reciprocal Rank for {name}: {system['mean']['reciprocal_rank']:.03f}")
 
-    print("")
+        if "map" in args.metrics:
+            print(f"Mean Average Precision for {name}: {system['mean']['average_precision']:.03f}")
 
-    #Mean Average Precision
-    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    print(f"Mean Average Precision for Vector Space Model: {round(metrics.mean_average_precision(vsm_results, queries_dataset), 3):03}")
-    print(f"Mean Average Precision for ColBERT: {round(metrics.mean_average_precision(colbert_results, queries_dataset), 3):03}")
+        if "ndcg" in args.metrics and system["average_ndcg"]:
+            print(f"Average NDCG for {name}: {system['average_ndcg'][-1]:.03f}")
 
-    print("")
+        print("")
 
-    #Average NDCG
+    #Significance
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    print(f"Average NDCG for Vector Space Model: {round(metrics.average_ndcg(vsm_results, queries_dataset)[-1], 3):03}")
-    print(f"Average NDCG for ColBERT: {round(metrics.average_ndcg(colbert_results, queries_dataset)[-1], 3):03}")
-
-    #NDCG
-    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    ndcg = {"Vector Space": [], "ColBERT": []}
-
-    print("\nNDCG for Vector Space Model\n=======================================================")
-
-    for i, results in enumerate(vsm_results):
-        res = f"{round(metrics.ndcg(results, queries_dataset[i]['answers']['docs'], queries_dataset[i]['answers']['scores'])[-1], 3):.03f}"
-
-        ndcg["Vector Space"].append(res)
-
-        print(f"NDCG for Query {i+1}: {res}")
-
-    print("\nNDCG for ColBERT\n=======================================================")
-
-    for i, results in enumerate(colbert_results):
-        res = f"{round(metrics.ndcg(results, queries_dataset[i]['answers']['docs'], queries_dataset[i]['answers']['scores'])[-1], 3):.03f}"
-
-        ndcg["ColBERT"].append(res)
-
-        print(f"NDCG for Query {i+1}: {res}")
+    for test in report.get("significance", []):
+        name_a, name_b = test["systems"]
 
+        print(f"{name_a} vs {name_b}, {test['metric']}\n-------------------")
+        print(f"Mean difference: {test['mean_difference']:.03f} (95% CI {test['ci'][0]:.03f} to {test['ci'][1]:.03f})")
+        print(f"Randomization test p-value: {test['randomization_p']:.04f}")
+        #t is None when it is infinite, i.e. every query has the same difference
+        t = "inf" if test["t"] is None else f"{test['t']:.03f}"
+        print(f"Paired t-test: t = {t}, p-value: {test['t_p']:.04f}\n")
 
-    dataset.excel("results/ndcg.xlsx", ndcg)
+    print("Full report: results/report.json, results/report.csv\n")
 
-     #Precision-Recall Diagram
+    #Precision-Recall Diagram
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    #See results/plots/ directory for all the saved plots 
-    show_on_screen = False
-    metrics.precision_recall_diagram(vsm_results, colbert_results, queries_dataset, None, show_on_screen)
+    #See results/plots/ directory for all the saved plots
+    if "diagram" in args.metrics:
+        metrics.precision_recall_diagram(results, queries_dataset, query_ids, args.show_plots, pdf=args.plots_pdf, grid=args.plots_grid)
@@ -2,13 +2,31 @@
 Implementations of various IR metrics
 '''
 
+import csv
+import hashlib
+import json
 import math
-from bisect import bisect_left
-from matplotlib import pyplot as plt
 import numpy
-import pandas as pd
 import os
-import shutil
+from concurrent.futures import ProcessPoolExecutor
+from collections import namedtuple
+from itertools import chain
+
+#matplotlib and pandas are only imported when a diagram is created, since they take a while to import
+
+#numpy.trapz was renamed to numpy.trapezoid in numpy 2.0
+trapezoid = getattr(numpy, "trapezoid", None) or numpy.trapz
+
+#==============================================================================================
+
+#Multiplier of the query index in the keys of Qrels. Larger than every document id, so keys of different queries never collide
+KEY_BASE = 2**32
+
+#The relevance judgements of every query, as flat arrays (see qrels_arrays)
+Qrels = namedtuple("Qrels", ["keys", "gains", "num_relevant"])
+
+#Interpolated precision-recall curves of every query of a run (see precision_recall_curves)
+Curves = namedtuple("Curves", ["recall", "precision", "areas", "mean_precision", "mean_area"])
 
 #==============================================================================================
 
@@ -45,27 +63,25 @@ def dcg(single_query_results, relevant, scores: "list[str]"):
     - dcg_vector
     - idcg_vector
     '''
-    #Calculate the gain
-    gain_vector = []
-
-
-    for doc in single_query_results:
+    #Calculate the gain. Documents that are not relevant have a gain of 0
+    gains = {doc: score_gain(score) for doc, score in zip(relevant, scores)}
 
-        index = bisect_left(relevant, doc)
-
-        if index == len(relevant) or relevant[index] != doc: #Document is not relevant
-            gain_vector.append(0)
-        else:
-            gain_vector.append(int(scores[index][0]) + int(scores[index][1]) + int(scores[index][2]) + int(scores[index][3]))
+    gain_vector = [gains.get(doc, 0) for doc in single_query_results]
 
     ideal_gain_vector = sorted(gain_vector, reverse = True)
 
-    #print(gain_vector,"\n",ideal_gain_vector,"\n")
-
     return gain_to_dcg(gain_vector), gain_to_dcg(ideal_gain_vector)
 
 #==============================================================================================
 
+def score_gain(score: str) -> int:
+    '''
+    The gain of a relevant document: the sum of the 4 digits of its score
+    '''
+    return int(score[0]) + int(score[1]) + int(score[2]) + int(score[3])
+
+#==============================================================================================
+
 def ndcg(single_query_results, relevant, scores):
     '''
     NDCG for a single query
@@ -77,19 +93,13 @@ def ndcg(single_query_results, relevant, scores):
 #==============================================================================================
 
 def average_ndcg(multiple_query_results, queries_dataset):
+    '''
+    The sum of the DCG vectors of all queries, divided by the sum of their ideal DCG vectors
+    '''
 
-    num_queries = queries_dataset.num_rows
-
-    avg_dcg = [0 for i in range(0, num_queries)]
-    avg_idcg = [0 for i in range(0, num_queries)]
-
-    for q, single_query_results in zip(queries_dataset, multiple_query_results):
-        dcg_vector, idcg_vector = dcg(single_query_results, q["answers"]["docs"], q["answers"]["scores"])
-
-        avg_dcg = [a + b for a,b, in zip(avg_dcg, dcg_vector)]
-        avg_idcg = [a + b for a,b, in zip(avg_idcg, idcg_vector)]
+    metrics = evaluate(multiple_query_results, qrels_arrays(queries_dataset))
 
-    return [a/b for a,b in zip(avg_dcg, avg_idcg)]
+    return (metrics["dcg_at_k"].sum(axis=0)/metrics["idcg_at_k"].sum(axis=0)).tolist()
 
 #==============================================================================================
     
@@ -184,19 +194,14 @@ def average_precision(single_query_results, relevant):
 
 def mean_average_precision(multiple_query_results, queries_dataset):
 
-    res = 0
-
-    for i, single_query_results in enumerate(multiple_query_results):
-        res += average_precision(single_query_results, queries_dataset[i]["answers"]["docs"])
-
-    return res/len(multiple_query_results)
+    return evaluate(multiple_query_results, qrels_arrays(queries_dataset))["average_precision"].mean()
 
 #==============================================================================================
 
 def precision_at_k(single_query_results, relevant, k: int):
     relevant_set = set(relevant)
 
-    top_k_results = single_query_results[:k]
+    top_k_results = set(single_query_results[:k])
 
     return len(top_k_results & relevant_set) / k
 
@@ -204,110 +209,409 @@ def precision_at_k(single_query_results, relevant, k: int):
 
 def mean_reciprocal_rank(multiple_query_results, queries_dataset):
 
-    res = 0
+    return evaluate(multiple_query_results, qrels_arrays(queries_dataset))["reciprocal_rank"].mean()
+
+#==============================================================================================
+
+def qrels_arrays(queries_dataset) -> Qrels:
+    '''
+    Materializes the relevance judgements of every query once, so that runs can be judged with array operations.
+
+    Returns a Qrels tuple of:
+    - keys: query index*KEY_BASE + document id, for the relevant documents of every query, sorted
+    - gains: The gain of each relevant document, in the order of keys (see score_gain)
+    - num_relevant: The number of relevant documents of each query
+    '''
+
+    answers = [q["answers"] for q in queries_dataset]
+
+    num_relevant = numpy.array([len(a["docs"]) for a in answers], dtype=numpy.int64)
+    docs = numpy.fromiter(chain.from_iterable(a["docs"] for a in answers), dtype=numpy.int64, count=num_relevant.sum())
+
+    keys = numpy.repeat(numpy.arange(len(answers), dtype=numpy.int64)*KEY_BASE, num_relevant) + docs
+
+    #Every score is 4 digits, so the gains are the sums of the rows of a (documents x 4) matrix of digits
+    digits = numpy.frombuffer("".join(chain.from_iterable(a["scores"] for a in answers)).encode("ascii"), dtype=numpy.uint8)
+    gains = (digits.reshape(-1, 4) - ord("0")).sum(axis=1).astype(numpy.float64)
+
+    order = numpy.argsort(keys, kind="stable")
+
+    return Qrels(keys[order], gains[order], num_relevant)
+
+#==============================================================================================
+
+def judge(multiple_query_results, qrels: Qrels):
+    '''
+    Turns a run into matrices with one row per query and one column per rank.
+    Queries with fewer results are padded, and the padding is neither retrieved nor relevant.
+
+    Returns:
+    - retrieved: True where the query has a result at that rank
+    - relevant: True where the result is relevant
+    - gains: The gain of each result, 0 if it isn't relevant
+    '''
+
+    num_queries = len(multiple_query_results)
+    k = max((len(results) for results in multiple_query_results), default=0)
+
+    docs = numpy.full((num_queries, k), -1, dtype=numpy.int64)
+
+    for i, results in enumerate(multiple_query_results):
+        docs[i, :len(results)] = results
+
+    retrieved = docs >= 0
+    keys = numpy.arange(num_queries, dtype=numpy.int64)[:, None]*KEY_BASE + docs
+
+    if len(qrels.keys) == 0:
+        return retrieved, numpy.zeros(docs.shape, dtype=bool), numpy.zeros(docs.shape)
+
+    #Position of each result in the sorted keys of the relevant documents
+    positions = numpy.minimum(numpy.searchsorted(qrels.keys, keys), len(qrels.keys) - 1)
+
+    relevant = retrieved & (qrels.keys[positions] == keys)
+    gains = numpy.where(relevant, qrels.gains[positions], 0)
+
+    return retrieved, relevant, gains
+
+#==============================================================================================
+
+def evaluate(multiple_query_results, qrels: Qrels) -> dict:
+    '''
+    Calculates every metric for every query and every cutoff at once, with array operations on the matrices of judge.
+    The results are the same as those of the single query functions of this module.
+
+    Parameters:
+    -   multiple_query_results: A list with the results of each query, in the order of the queries in qrels
+    -   qrels: The relevance judgements, returned by qrels_arrays
+
+    Returns a dictionary of numpy arrays:
+    - "precision", "recall", "fscore", "average_precision", "reciprocal_rank", "ndcg": One value per query, for all its results
+    - "precision_at_k", "recall_at_k", "fscore_at_k", "dcg_at_k", "idcg_at_k", "ndcg_at_k": (queries x ranks) matrices,
+    with the value of each query at every cutoff, as returned with vector=True or by dcg and ndcg
+    '''
+
+    retrieved, relevant, gains = judge(multiple_query_results, qrels)
+
+    num_queries, k = relevant.shape
+    ranks = numpy.arange(1, k + 1)
+
+    num_relevant = qrels.num_relevant[:num_queries, None].astype(numpy.float64)
+    num_retrieved = retrieved.sum(axis=1)
+
+    hits = numpy.cumsum(relevant, axis=1)
+
+    precision_at_k = hits/ranks
+    recall_at_k = divide(hits, num_relevant)
+    fscore_at_k = divide(2*precision_at_k*recall_at_k, precision_at_k + recall_at_k)
+
+    total_hits = hits[:, -1] if k > 0 else numpy.zeros(num_queries)
+    first_hit = numpy.argmax(relevant, axis=1) if k > 0 else numpy.zeros(num_queries)
+
+    precision = divide(total_hits, num_retrieved)
+    recall = divide(total_hits, num_relevant[:, 0])
+
+    #The first rank is not discounted, rank i > 1 is discounted by log2(i)
+    discounts = numpy.ones(k)
+    discounts[1:] = numpy.log2(ranks[1:])
 
-    for i, single_query_results in enumerate(multiple_query_results):
-        relevant = queries_dataset[i]["answers"]["docs"]
+    dcg_at_k = numpy.cumsum(gains/discounts, axis=1)
+    idcg_at_k = numpy.cumsum(-numpy.sort(-gains, axis=1)/discounts, axis=1)
+    ndcg_at_k = divide(dcg_at_k, idcg_at_k)
 
-        for rank, result in enumerate(single_query_results):
-            if result in relevant:
-                res += 1/(rank + 1)
-                break
+    return {
+        "precision": precision,
+        "recall": recall,
+        "fscore": divide(2*precision*recall, precision + recall),
+        "average_precision": divide((precision_at_k*relevant).sum(axis=1), num_relevant[:, 0]),
+        "reciprocal_rank": numpy.where(relevant.any(axis=1), 1/(first_hit + 1), 0),
+        "ndcg": ndcg_at_k[:, -1] if k > 0 else numpy.zeros(num_queries),
+        "precision_at_k": precision_at_k,
+        "recall_at_k": recall_at_k,
+        "fscore_at_k": fscore_at_k,
+        "dcg_at_k": dcg_at_k,
+        "idcg_at_k": idcg_at_k,
+        "ndcg_at_k": ndcg_at_k
+    }
 
-    return res/len(multiple_query_results)
+#==============================================================================================
+
+def precision_recall_curves(multiple_query_results, qrels: Qrels, points: int = 11) -> Curves:
+    '''
+    Calculates the interpolated precision-recall curve of every query at once.
+    The interpolated precision at a recall level is the highest precision at any rank where the recall is at least that level,
+    or 0 if the level is never reached.
+
+    Parameters:
+    -   multiple_query_results: A list with the results of each query, in the order of the queries in qrels
+    -   qrels: The relevance judgements, returned by qrels_arrays
+    -   points: The number of recall levels, evenly spaced from 0 to 1. 11 gives the standard 11-point curves
+
+    Returns a Curves tuple of:
+    - recall: The recall levels
+    - precision: (queries x levels) matrix of the interpolated precision of each query
+    - areas: The area under each query's curve
+    - mean_precision: The curve averaged over the queries
+    - mean_area: The area under the averaged curve
+    '''
+
+    retrieved, relevant, _ = judge(multiple_query_results, qrels)
+
+    num_queries, k = relevant.shape
+
+    #i/(points - 1) is rounded the same way as hits/num_relevant, so a level is reached exactly when the ratios are equal
+    levels = numpy.arange(points)/(points - 1)
+
+    if k == 0:
+        precision = numpy.zeros((num_queries, points))
+    else:
+        hits = numpy.cumsum(relevant, axis=1)
+
+        precision_at_k = numpy.where(retrieved, hits/numpy.arange(1, k + 1), 0)
+        recall_at_k = divide(hits, qrels.num_relevant[:num_queries, None])
+
+        #Highest precision at this rank or any later one
+        best_precision = numpy.maximum.accumulate(precision_at_k[:, ::-1], axis=1)[:, ::-1]
+
+        #The recall of each row only grows, and is at most 1, so after adding 2*row the whole matrix is sorted
+        #and the first rank of every row that reaches every level is found with a single searchsorted
+        offsets = 2*numpy.arange(num_queries)[:, None]
+        first = numpy.searchsorted((recall_at_k + offsets).ravel(), (levels + offsets).ravel()).reshape(num_queries, points)
+
+        reached = first < (offsets//2 + 1)*k
+        precision = numpy.where(reached, best_precision.ravel()[numpy.minimum(first, num_queries*k - 1)], 0)
+
+    mean_precision = precision.mean(axis=0) if num_queries else numpy.zeros(points)
+
+    return Curves(levels, precision, trapezoid(precision, levels, axis=1), mean_precision, trapezoid(mean_precision, levels))
+
+#==============================================================================================
+
+#The per query metrics of a report, in the order of its files (see evaluate)
+REPORT_METRICS = ["precision", "recall", "fscore", "average_precision", "reciprocal_rank", "ndcg"]
+
+#==============================================================================================
+
+def report(results: dict, qrels: Qrels, query_ids: list) -> dict:
+    '''
+    Evaluates every system with evaluate, in a single pass over its results.
+
+    Parameters:
+    -   results: A dictionary of system names, containing the results of each query
+    -   qrels: The relevance judgements, returned by qrels_arrays
+    -   query_ids: The id of each query
+
+    Returns a dictionary that can be written as json:
+    - "queries": query_ids
+    - "systems": For each system name a dictionary of:
+        - "per_query": The list of each metric in REPORT_METRICS, with one value per query
+        - "mean": The mean of each metric over the queries. "average_precision" is the MAP and "reciprocal_rank" the MRR
+        - "average_ndcg": The NDCG at every cutoff, with the DCG and ideal DCG summed over the queries (see average_ndcg)
+        - "interpolated_precision": The 11-point interpolated precision-recall curve, averaged over the queries (see precision_recall_curves)
+    '''
+
+    systems = dict()
+
+    for name, system_results in results.items():
+        values = evaluate(system_results, qrels)
+
+        systems[name] = {
+            "per_query": {metric: values[metric].tolist() for metric in REPORT_METRICS},
+            "mean": {metric: float(values[metric].mean()) if len(values[metric]) else 0.0 for metric in REPORT_METRICS},
+            "average_ndcg": divide(values["dcg_at_k"].sum(axis=0), values["idcg_at_k"].sum(axis=0)).tolist(),
+            "interpolated_precision": precision_recall_curves(system_results, qrels).mean_precision.tolist()
+        }
+
+    return {"queries": list(query_ids), "systems": systems}
+
+#==============================================================================================
+
+def write_report(report: dict, path: str):
+    '''
+    Writes a report to path.json, and its per query metrics to path.csv, with one row per system and query
+    '''
+
+    with open(path + ".json", "w") as f:
+        #Infinities and NaNs would be written as invalid json
+        json.dump(report, f, indent="\t", allow_nan=False)
+
+    with open(path + ".csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["system", "query"] + REPORT_METRICS)
+
+        for name, system in report["systems"].items():
+            for i, query_id in enumerate(report["queries"]):
+                writer.writerow([name, query_id] + [system["per_query"][metric][i] for metric in REPORT_METRICS])
 
 #==============================================================================================
 
-def precision_recall_diagram(vsm_results, colbert_results, queries_dataset, query_ids: list, show_on_screen: bool):
+def divide(a, b):
+    '''
+    Element-wise a/b, with 0 where b is 0
     '''
-    Creates a precision-recall diagram for the specified queries and saves them under plots/
+    a, b = numpy.broadcast_arrays(numpy.asarray(a, dtype=numpy.float64), numpy.asarray(b, dtype=numpy.float64))
+
+    return numpy.divide(a, b, out=numpy.zeros(a.shape), where=b != 0)
+
+#==============================================================================================
+
+def precision_recall_diagram(results: dict, queries_dataset, query_ids: list, show_on_screen: bool,
+                             processes: int = None, pdf: bool = False, grid: bool = False, points: int = 11):
+    '''
+    Creates an interpolated precision-recall diagram (see precision_recall_curves) for the specified queries,
+    and one with the curves averaged over them, and saves them under results/plots/.
+    The area under each curve is written to results/precision_recall_area.xlsx.
+
+    The figures are rendered by a pool of processes with the non-interactive Agg backend, and each figure is closed once saved.
+    The calling process only switches to Agg when show_on_screen is False.
+    The curves of every diagram are hashed into results/plots/manifest.json, and diagrams whose curves haven't changed
+    since the last call are not rendered again.
 
     Parameters
-    -   vsm_results: A list of lists, containing the search results of the Vector Space Model for every query
-    -   colbert_results: A list of lists, containing the search results of ColBERT for every query
+    -   results: A dictionary of system names, containing the search results of each query
     -   queries_dataset: The dataset of queries, returned by load_datasets
     -   query_ids: A list of query IDs for which you want to make diagrams. Set None for all
     -   show_on_screen: Determines whether the plots should be shown on the screen on top of being saved
+    -   processes: The number of rendering processes. By default, the number of cores
+    -   pdf: If True, all diagrams are also saved as the pages of results/plots/precision_recall.pdf
+    -   grid: If True, all diagrams are also combined into a grid in results/plots/precision_recall_grid.png
+    -   points: The number of recall levels of the curves
     '''
+    import pandas as pd
 
-    if os.path.exists("results/plots/"):
-        shutil.rmtree("results/plots/")
-
-    os.makedirs("results/plots")
-
-    data = {"Vector Space":[], "ColBERT": []}
+    os.makedirs("results/plots", exist_ok=True)
 
     if query_ids is None:
         query_ids = range(1,len(queries_dataset)+1)
 
+    query_ids = list(query_ids)
+    queries = [queries_dataset[query_id - 1] for query_id in query_ids]
+    qrels = qrels_arrays(queries)
+
+    curves = {name: precision_recall_curves([system_results[query_id - 1] for query_id in query_ids], qrels, points)
+              for name, system_results in results.items()}
+
+    data = {name: numpy.round(system_curves.areas, 3).tolist() for name, system_curves in curves.items()}
+
+    df = pd.DataFrame(data, index=query_ids)
+    df.to_excel("results/precision_recall_area.xlsx", index_label="Query ID")
+
+    diagrams = dict() #file name => (title, {system name: (recall, precision)})
+
     for i, query_id in enumerate(query_ids):
-        relevant = queries_dataset[query_id - 1]["answers"]["docs"]
-        k = len(relevant)
+        diagrams[f"query_{query_id:02}.png"] = (f"Precision-Recall diagram for Query {query_id:02}",
+                                                {name: (c.recall.tolist(), c.precision[i].tolist()) for name, c in curves.items()})
 
-        recall = [i/k for i in range(1, k+1)]
+    diagrams["average.png"] = (f"Average Precision-Recall diagram of {len(query_ids)} queries",
+                               {name: (c.recall.tolist(), c.mean_precision.tolist()) for name, c in curves.items()})
 
-        #VSM
-        #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    #Only the diagrams whose curves changed are rendered
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    manifest_path = "results/plots/manifest.json"
+    manifest = dict() #file name => hash of its curves
 
-        rel_count = 0
-        total = 0
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
 
-        precision = []
+    changed = []
 
-        for res in vsm_results[query_id - 1]:
-            total += 1
-            if res in relevant:
-                rel_count += 1
-                precision.append(rel_count/total)
+    for filename, (title, diagram_curves) in diagrams.items():
+        digest = hashlib.sha1(json.dumps([title, diagram_curves]).encode("utf-8")).hexdigest()
 
-        for _ in range(k - len(precision)):
-            precision.append(0)
+        if manifest.get(filename) != digest or not os.path.exists("results/plots/" + filename):
+            changed.append((title, diagram_curves, "results/plots/" + filename))
+            manifest[filename] = digest
 
-        area1 = numpy.trapz(precision, recall)
+    if processes is None:
+        processes = os.cpu_count() or 1
 
-        fig, ax = plt.subplots()
+    #This process keeps its interactive backend when the diagrams are shown on screen
+    import matplotlib
 
-        ax.plot(recall, precision, label="Vector Space")
+    if not show_on_screen:
+        matplotlib.use("Agg")
 
-        ax.set_xlabel("Recall")
-        ax.set_ylabel("Precision")
-        ax.set_title(f"Precision-Recall diagram for Query {query_id:02}")
+    from matplotlib import pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
 
-        #Colbert
-        #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    if processes > 1 and len(changed) > 1:
+        with ProcessPoolExecutor(min(processes, len(changed)), initializer=use_agg_backend) as pool:
+            list(pool.map(render_diagram, *zip(*changed)))
+    else:
+        for args in changed:
+            render_diagram(*args)
 
-        rel_count = 0
-        total = 0
+    #Combined outputs, rendered in this process one figure at a time
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-        precision = []
+    if pdf and (changed or not os.path.exists("results/plots/precision_recall.pdf")):
+        with PdfPages("results/plots/precision_recall.pdf") as pages:
+            for title, diagram_curves in diagrams.values():
+                fig, ax = plt.subplots()
+                draw_diagram(ax, title, diagram_curves)
+                pages.savefig(fig)
+                plt.close(fig)
 
-        for res in colbert_results[query_id - 1]:
-            total += 1
-            if res in relevant:
-                rel_count += 1
-                precision.append(rel_count/total)
+    if grid and (changed or not os.path.exists("results/plots/precision_recall_grid.png")):
+        columns = math.ceil(math.sqrt(len(diagrams)))
+        rows = math.ceil(len(diagrams)/columns)
 
-        for _ in range(k - len(precision)):
-            precision.append(0)
+        fig, axes = plt.subplots(rows, columns, figsize=(4*columns, 3*rows), squeeze=False)
 
-        area2 = numpy.trapz(precision, recall)
+        for ax, (title, diagram_curves) in zip(axes.flat, diagrams.values()):
+            draw_diagram(ax, title, diagram_curves)
 
-        ax.plot(recall, precision, label="ColBERT")
+        for ax in axes.flat[len(diagrams):]:
+            ax.axis("off")
 
-        ax.legend()
+        fig.tight_layout()
+        fig.savefig("results/plots/precision_recall_grid.png")
+        plt.close(fig)
 
-        #print(f"Query {query_id:02}\n================\nVSM: {round(area1, 3)}\nColBERT: {round(area2, 3)}\n")
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent="\t")
 
-        data["Vector Space"].append(round(area1, 3))
-        data["ColBERT"].append(round(area2, 3))
+    if show_on_screen:
+        for i, (title, diagram_curves) in enumerate(diagrams.values()):
+            fig, ax = plt.subplots()
+            draw_diagram(ax, title, diagram_curves)
+            plt.show(block = i == len(diagrams) - 1)
 
-        fig.savefig(f"results/plots/query_{query_id:02}.png")
+#==============================================================================================
+
+def draw_diagram(ax, title: str, curves: dict):
+    '''
+    Draws the precision-recall curve of each system on ax
+    '''
+
+    for name, (recall, precision) in curves.items():
+        ax.plot(recall, precision, label=name)
+
+    ax.set_xlabel("Recall")
+    ax.set_ylabel("Precision")
+    ax.set_title(title)
+
+    ax.legend()
+
+#==============================================================================================
+
+def use_agg_backend():
+    '''
+    Switches the rendering processes of precision_recall_diagram to the non-interactive Agg backend
+    '''
+    import matplotlib
+    matplotlib.use("Agg")
 
-        if i == len(query_ids) - 1:
-            df = pd.DataFrame(data, index=query_ids)
-            df.to_excel("results/precision_recall_area.xlsx", index_label="Query ID")
+#==============================================================================================
+
+def render_diagram(title: str, curves: dict, path: str):
+    '''
+    Saves a diagram to path, with the current backend.
+    Runs in the rendering processes of precision_recall_diagram, or in the calling process if there is only one
+    '''
+    from matplotlib import pyplot as plt
 
-            if show_on_screen:
-                plt.show(block = True)
-        elif show_on_screen:
-            plt.show(block = False)
\ No newline at end of file
+    fig, ax = plt.subplots()
+    draw_diagram(ax, title, curves)
+    fig.savefig(path)
+    plt.close(fig)
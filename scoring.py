@@ -0,0 +1,155 @@
+'''
+Scoring functions (weighting methods) for the Vector Space Model
+'''
+
+import math
+from collections import namedtuple
+
+#==============================================================================================
+
+#Collection statistics available to the scorers. Statistics that a scorer doesn't require are None
+CollectionStatistics = namedtuple("CollectionStatistics", ["num_docs", "max_doc_freq", "doc_lengths", "avg_doc_length"])
+
+#==============================================================================================
+
+class Scorer:
+    '''
+    A weighting method. The weight of every posting is calculated once, when the index is built,
+    so a query's score for a document is the sum of (query weight * posting weight) over the query terms.
+
+    Subclasses declare the statistics they need in required_statistics ("max_doc_freq", "doc_lengths", "avg_doc_length"),
+    so that only those are calculated, once for the whole collection.
+    '''
+
+    required_statistics = set()
+
+    #If True, the posting weights are divided by the norm of their document (cosine similarity)
+    normalize = True
+
+    def idf(self, num_docs: int, doc_freq: int) -> float:
+        '''
+        The inverse document frequency of a term, stored in the index
+        '''
+        return math.log(num_docs/doc_freq, 10)
+
+    def doc_weight(self, f: int, doc: int, doc_freq: int, stats: CollectionStatistics) -> float:
+        '''
+        The weight of a term that appears f times in document doc
+        '''
+        raise NotImplementedError
+
+    def query_weight(self, f: int, max_query_freq: int, idf: float) -> float:
+        '''
+        The weight of a term that appears f times in the query
+        '''
+        return (0.5 + 0.5*f/max_query_freq)*idf
+
+#==============================================================================================
+
+class TFC(Scorer):
+    '''
+    tf * idf, with cosine normalization
+    '''
+
+    def doc_weight(self, f, doc, doc_freq, stats):
+        return f*math.log(stats.num_docs/doc_freq, 10)
+
+#==============================================================================================
+
+class TXC(Scorer):
+    '''
+    Raw term frequency, with cosine normalization
+    '''
+
+    def doc_weight(self, f, doc, doc_freq, stats):
+        return f
+
+#==============================================================================================
+
+class BM25(Scorer):
+    '''
+    Okapi BM25. The idf is part of the document weight, and the query weight is the term's frequency in the query.
+    '''
+
+    required_statistics = {"doc_lengths", "avg_doc_length"}
+    normalize = False
+
+    def __init__(self, k1 = 1.2, b = 0.75):
+        self.k1 = k1
+        self.b = b
+
+    def idf(self, num_docs, doc_freq):
+        #Never negative, even for terms that appear in more than half of the documents
+        return math.log((num_docs - doc_freq + 0.5)/(doc_freq + 0.5) + 1)
+
+    def tf(self, f, doc, stats):
+        '''
+        The saturated term frequency, normalized by the length of the document
+        '''
+        length_norm = 1 - self.b + self.b*stats.doc_lengths[doc]/stats.avg_doc_length
+        return f*(self.k1 + 1)/(f + self.k1*length_norm)
+
+    def doc_weight(self, f, doc, doc_freq, stats):
+        return self.idf(stats.num_docs, doc_freq)*self.tf(f, doc, stats)
+
+    def query_weight(self, f, max_query_freq, idf):
+        return f
+
+#==============================================================================================
+
+class BM25Plus(BM25):
+    '''
+    BM25+, which adds delta to the term frequency component, so that long documents are not penalized too much
+    '''
+
+    def __init__(self, k1 = 1.2, b = 0.75, delta = 1.0):
+        super().__init__(k1, b)
+        self.delta = delta
+
+    def doc_weight(self, f, doc, doc_freq, stats):
+        return self.idf(stats.num_docs, doc_freq)*(self.tf(f, doc, stats) + self.delta)
+
+#==============================================================================================
+
+#Every weighting method, by the number used for it in weighting_method. New scorers can be added here
+SCORERS = {
+    0: TFC(),
+    1: TXC(),
+    2: BM25(),
+    3: BM25Plus()
+}
+
+#==============================================================================================
+
+def get_scorer(weighting_method: int) -> Scorer:
+    '''
+    Returns the scorer of a weighting method
+    '''
+    if weighting_method not in SCORERS:
+        raise ValueError(f"Unknown weighting method: {weighting_method}")
+
+    return SCORERS[weighting_method]
+
+#==============================================================================================
+
+def collection_statistics(scorer: Scorer, num_docs: int, max_doc_freq: dict, doc_lengths: dict) -> CollectionStatistics:
+    '''
+    Keeps the statistics that the scorer requires.
+
+    - num_docs: The number of documents in the collection
+    - max_doc_freq: A dictionary of documents containing their max frequency
+    - doc_lengths: A dictionary of documents containing their number of words
+    '''
+
+    avg_doc_length = None
+
+    #An empty collection has no documents to weigh, so its average length is left as 0
+    if "avg_doc_length" in scorer.required_statistics:
+        avg_doc_length = sum(doc_lengths.values())/len(doc_lengths) if doc_lengths else 0
+
+    return CollectionStatistics(
+        num_docs,
+        max_doc_freq if "max_doc_freq" in scorer.required_statistics else None,
+        doc_lengths if "doc_lengths" in scorer.required_statistics else None,
+        avg_doc_length
+    )
@@ -0,0 +1,250 @@
+'''
+A long-running search server. The VSM index and the ColBERT searcher are loaded once and then serve queries over HTTP,
+either on a TCP port or on a Unix socket.
+
+Usage:
+    python server.py [--port 8000 | --socket /tmp/search.sock] [--no-colbert]
+
+Endpoints:
+    GET /search?q=<query>&k=<num_results>&model=<vsm|colbert>  => {"results": [document ids]}
+    GET /stats                                                 => Hit and miss counters of the query cache
+'''
+
+import argparse
+import json
+import os
+import queue
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import vsm
+import cache
+
+#==============================================================================================
+
+class RequestBatcher:
+    '''
+    Collects the queries of concurrent requests and runs them together in a single thread.
+    A batch is started as soon as a query arrives, and is filled with the queries that arrive within max_wait seconds,
+    up to max_batch_size. Queries with a different number of results go to separate calls of batch_function.
+    '''
+
+    def __init__(self, batch_function, max_batch_size: int = 32, max_wait: float = 0.005):
+        '''
+        - batch_function: Called as batch_function(queries, num_results), returns a list with the results of each query
+        '''
+
+        self.batch_function = batch_function
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.requests = queue.Queue()
+
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    #==========================================================================================
+
+    def search(self, query: str, num_results: int) -> list:
+        '''
+        Adds the query to the next batch and waits for its results
+        '''
+
+        request = {"query": query, "num_results": num_results, "done": threading.Event(), "results": None, "error": None}
+        self.requests.put(request)
+        request["done"].wait()
+
+        if request["error"] is not None:
+            raise request["error"]
+
+        return request["results"]
+
+    #==========================================================================================
+
+    def run(self):
+        '''
+        The worker thread
+        '''
+
+        while True:
+            batch = [self.requests.get()]
+
+            try:
+                while len(batch) < self.max_batch_size:
+                    batch.append(self.requests.get(timeout=self.max_wait))
+            except queue.Empty:
+                pass
+
+            groups = dict() #num_results: int => [requests]
+
+            for request in batch:
+                groups.setdefault(request["num_results"], []).append(request)
+
+            for num_results, requests in groups.items():
+                try:
+                    results = self.batch_function([request["query"] for request in requests], num_results)
+
+                    for request, request_results in zip(requests, results):
+                        request["results"] = request_results
+                except Exception as e:
+                    for request in requests:
+                        request["error"] = e
+
+                for request in requests:
+                    request["done"].set()
+
+#==============================================================================================
+
+class UnixHTTPServer(ThreadingHTTPServer):
+    '''
+    ThreadingHTTPServer listening on a Unix socket instead of a TCP port
+    '''
+
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+        self.socket.bind(self.server_address)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+#==============================================================================================
+
+def make_handler(models: dict, query_cache: cache.QueryCache):
+    '''
+    Returns the request handler class for the server.
+
+    - models: A dictionary of model names, containing a function search(query, num_results) for each model
+    - query_cache: The cache of search results
+    '''
+
+    class SearchHandler(BaseHTTPRequestHandler):
+
+        def send_json(self, status: int, data):
+            body = json.dumps(data).encode("utf-8")
+
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = parse_qs(url.query)
+
+            if url.path == "/stats":
+                self.send_json(200, query_cache.stats())
+                return
+
+            if url.path != "/search":
+                self.send_json(404, {"error": f"Unknown path: {url.path}"})
+                return
+
+            model = params.get("model", ["vsm"])[0]
+
+            if model not in models:
+                self.send_json(400, {"error": f"Unknown model: {model}. Available models: {list(models)}"})
+                return
+
+            if "q" not in params:
+                self.send_json(400, {"error": "Missing query parameter q"})
+                return
+
+            query = params["q"][0]
+
+            try:
+                num_results = int(params.get("k", ["20"])[0])
+            except ValueError:
+                num_results = 0
+
+            if num_results < 1:
+                self.send_json(400, {"error": "k must be a positive integer"})
+                return
+
+            try:
+                results = query_cache.search(model, query, num_results, lambda: models[model](query, num_results))
+            except Exception as e:
+                self.send_json(500, {"error": f"Search failed: {e}"})
+                return
+
+            self.send_json(200, {"results": results})
+
+        def log_message(self, format, *args):
+            pass
+
+    return SearchHandler
+
+#==============================================================================================
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Serve VSM and ColBERT search results over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--socket", help="Listen on this Unix socket instead of a TCP port")
+    parser.add_argument("--docs", default="original_dataset/docs/", help="Directory with the original documents")
+    parser.add_argument("--queries", default="original_dataset/cfquery_detailed", help="The detailed query list")
+    parser.add_argument("--vsm-index", default="results/inverted_index.bin", help="Binary VSM index, created if it doesn't exist and rebuilt when the documents or the index settings change")
+    parser.add_argument("--weighting-method", type=int, default=0, help="VSM weighting method (see scoring.SCORERS)")
+    parser.add_argument("--codec", default="none", choices=["none", "vbyte", "bitpack"],
+                        help="Compression of the VSM postings. vbyte and bitpack make the index less than half as large, but searches about 1.5 times slower")
+    parser.add_argument("--colbert-index", default="index_1", help="Name of the ColBERT index")
+    parser.add_argument("--no-colbert", action="store_true", help="Only serve the Vector Space Model")
+    parser.add_argument("--batch-size", type=int, default=32, help="Max number of ColBERT queries encoded together")
+    parser.add_argument("--cache-size", type=int, default=10000, help="Max number of cached results")
+    parser.add_argument("--cache-ttl", type=float, default=None, help="Seconds before a cached result expires")
+    args = parser.parse_args()
+
+    codec = None if args.codec == "none" else args.codec
+
+    #Vector Space Model
+    #==============================================================================================
+    os.makedirs("results", exist_ok=True)
+
+    #The saved index is only reused if it was built the same way, from the current documents
+    source = vsm.index_source(args.docs)
+
+    if vsm.index_header(args.vsm_index) == (args.weighting_method, codec, source):
+        index, doc_norms, max_doc_freq = vsm.load_index(args.vsm_index)
+    else:
+        index, doc_norms, max_doc_freq = vsm.write_index(args.docs, args.weighting_method, compact=True, codec=codec)
+        vsm.save_index(args.vsm_index, index, doc_norms, max_doc_freq, args.weighting_method, source)
+
+    models = {"vsm": lambda query, num_results: vsm.search(index, doc_norms, max_doc_freq, query, num_results, args.weighting_method)}
+
+    #ColBERT
+    #==============================================================================================
+    if not args.no_colbert:
+        import dataset
+        import colbert_helper
+
+        docs_dataset, _ = dataset.load_datasets(args.docs, args.queries)
+        searcher = colbert_helper.get_searcher(docs_dataset, colbert_helper.Settings(index_name=args.colbert_index))
+
+        #The searcher is only used by the batcher's thread, which encodes each batch of queries together
+        def colbert_batch(queries, num_results):
+            return colbert_helper.search_batch(searcher, docs_dataset, queries, num_results, batch_size=args.batch_size)
+
+        batcher = RequestBatcher(colbert_batch, max_batch_size=args.batch_size)
+        models["colbert"] = batcher.search
+
+    #Server
+    #==============================================================================================
+    handler = make_handler(models, cache.QueryCache(args.cache_size, args.cache_ttl))
+
+    if args.socket:
+        server = UnixHTTPServer(args.socket, handler)
+        print(f"Listening on {args.socket}")
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), handler)
+        print(f"Listening on http://{args.host}:{args.port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
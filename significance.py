@@ -0,0 +1,160 @@
+'''
+Statistical significance tests between systems, over their per query metrics (see metrics.report)
+'''
+
+import math
+from itertools import combinations
+
+import numpy
+
+#Max number of (resample x query) entries held in memory at once by the resampling tests
+MAX_BATCH_ENTRIES = 2**24
+
+#==============================================================================================
+
+def paired_randomization_test(a, b, permutations: int = 100000, seed: int = None) -> float:
+    '''
+    Two-sided paired randomization (permutation) test of the difference of the means of a and b.
+    Under the null hypothesis the two systems are interchangeable, so the sign of each per query difference is flipped at random.
+
+    All permutations are drawn as random bits, a batch at a time. The sum of the differences with flipped signs is
+    2*(bits @ differences) - sum(differences), so each batch costs a single matrix-vector product.
+
+    Parameters:
+    -   a, b: The values of a metric for each query, for the two systems, in the same query order
+    -   permutations: The number of random sign flips
+    -   seed: Seed of the random generator, for repeatable results
+
+    Returns:
+    - The p-value: the fraction of permutations with an absolute difference at least as large as the observed one
+    (counting the observed one, so it is never 0)
+    '''
+
+    differences = numpy.asarray(a, dtype=numpy.float64) - numpy.asarray(b, dtype=numpy.float64)
+    n = len(differences)
+
+    if n == 0:
+        return 1.0
+
+    rng = numpy.random.default_rng(seed)
+
+    total = differences.sum()
+
+    #Tolerance for sums that are equal to the observed one, but were added in a different order
+    observed = abs(total) - 1e-9*max(1.0, numpy.abs(differences).sum())
+
+    batch_size = max(1, MAX_BATCH_ENTRIES//n)
+    count = 0
+
+    for batch_start in range(0, permutations, batch_size):
+        rows = min(batch_size, permutations - batch_start)
+
+        bits = numpy.unpackbits(rng.integers(0, 256, (rows, (n + 7)//8), dtype=numpy.uint8), axis=1, count=n)
+        sums = 2*(bits @ differences) - total
+
+        count += int(numpy.count_nonzero(numpy.abs(sums) >= observed))
+
+    return (count + 1)/(permutations + 1)
+
+#==============================================================================================
+
+def bootstrap_ci(values, resamples: int = 10000, confidence: float = 0.95, seed: int = None) -> tuple:
+    '''
+    Percentile bootstrap confidence interval of the mean of values.
+    For paired systems, values are the per query differences of a metric.
+
+    The queries of all resamples are drawn at once, a batch at a time, and each batch is averaged with a single reduction.
+
+    Returns:
+    - The mean of values
+    - The lower bound of the interval
+    - The upper bound of the interval
+    '''
+
+    values = numpy.asarray(values, dtype=numpy.float64)
+    n = len(values)
+
+    if n == 0:
+        return 0.0, 0.0, 0.0
+
+    rng = numpy.random.default_rng(seed)
+
+    batch_size = max(1, MAX_BATCH_ENTRIES//n)
+    means = numpy.empty(resamples)
+
+    for batch_start in range(0, resamples, batch_size):
+        rows = min(batch_size, resamples - batch_start)
+        means[batch_start:batch_start + rows] = values[rng.integers(0, n, (rows, n))].mean(axis=1)
+
+    alpha = (1 - confidence)/2
+    low, high = numpy.quantile(means, [alpha, 1 - alpha])
+
+    return float(values.mean()), float(low), float(high)
+
+#==============================================================================================
+
+def paired_t_test(a, b) -> tuple:
+    '''
+    Two-sided paired t-test of the difference of the means of a and b
+
+    Returns:
+    - The t statistic. It is infinite if every difference is the same and not 0
+    - The p-value
+    '''
+    from scipy.stats import t as t_distribution
+
+    differences = numpy.asarray(a, dtype=numpy.float64) - numpy.asarray(b, dtype=numpy.float64)
+    n = len(differences)
+
+    if n < 2:
+        return 0.0, 1.0
+
+    mean = differences.mean()
+    deviation = differences.std(ddof=1)
+
+    #Every difference is the same. Equal float differences can still have a tiny deviation from rounding,
+    #so it is compared to the mean instead of 0
+    if deviation <= 1e-12*abs(mean):
+        return (0.0, 1.0) if mean == 0 else (math.copysign(math.inf, mean), 0.0)
+
+    t = mean/(deviation/math.sqrt(n))
+
+    return float(t), float(2*t_distribution.sf(abs(t), n - 1))
+
+#==============================================================================================
+
+def compare(report: dict, metrics: tuple = ("average_precision", "ndcg"), permutations: int = 100000, resamples: int = 10000,
+            confidence: float = 0.95, seed: int = 0) -> list:
+    '''
+    Runs every test for every pair of systems of a report (see metrics.report) and every metric in metrics.
+
+    Returns a list with a dictionary for each pair and metric, that can be written as json:
+    - "systems": The names of the two systems
+    - "metric": The name of the metric
+    - "mean_difference": The mean of the first system's metric minus the second's
+    - "ci": The bootstrap confidence interval of the mean difference
+    - "randomization_p": The p-value of the paired randomization test
+    - "t", "t_p": The statistic and the p-value of the paired t-test. An infinite t is stored as None, since json has no infinity
+    '''
+
+    tests = []
+
+    for (name_a, system_a), (name_b, system_b) in combinations(report["systems"].items(), 2):
+        for metric in metrics:
+            a = numpy.array(system_a["per_query"][metric])
+            b = numpy.array(system_b["per_query"][metric])
+
+            mean_difference, low, high = bootstrap_ci(a - b, resamples, confidence, seed)
+            t, t_p = paired_t_test(a, b)
+
+            tests.append({
+                "systems": [name_a, name_b],
+                "metric": metric,
+                "mean_difference": mean_difference,
+                "ci": [low, high],
+                "randomization_p": paired_randomization_test(a, b, permutations, seed),
+                "t": t if math.isfinite(t) else None,
+                "t_p": t_p
+            })
+
+    return tests
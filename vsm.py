@@ -3,20 +3,185 @@ Everything related to the Vector Space Model
 '''
 
 import math
+import re
+import numpy
+import heapq
+from bisect import bisect_left
+from collections import namedtuple
+from array import array
+import mmap
+import struct
+import os
+import pickle
+import json
+import shutil
+from itertools import accumulate, groupby
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import compression
+import dataset
+import scoring
+
+#==============================================================================================
+
+#Identifies the binary index files written by save_index
+INDEX_MAGIC = b"VSMIDX04"
+
+#Postings codecs, as stored in the binary index files. None means that the postings are not compressed (CompactIndex)
+INDEX_CODECS = [None, "vbyte", "bitpack"]
+
+#The array type of each section of the binary index file, in the order they are written, for each type of index
+INDEX_SECTIONS = {
+    None: [
+        ("doc_freqs", "i"), ("upper_bounds", "d"), ("idfs", "d"), ("offsets", "q"), ("doc_ids", "i"), ("freqs", "i"),
+        ("weights", "d"), ("pos_offsets", "q"), ("positions", "i")
+    ],
+    "compressed": [
+        ("doc_freqs", "i"), ("upper_bounds", "d"), ("idfs", "d"), ("offsets", "q"), ("weights", "H"), ("block_starts", "q"),
+        ("block_last_docs", "i"), ("block_offsets", "q"), ("postings", "B"), ("block_pos_offsets", "q"), ("positions", "B")
+    ]
+}
+
+#The sections that hold offsets into another section, and that section. Each starts with a 0 and has one more value per term,
+#block or posting (see CompactIndex and CompressedIndex)
+INDEX_OFFSETS = {
+    "offsets": "weights", "pos_offsets": "positions", "block_starts": "block_last_docs", "block_offsets": "postings",
+    "block_pos_offsets": "positions"
+}
+
+#In a CompressedIndex, each weight is stored as an integer from 0 to WEIGHT_LEVELS, in units of the term's upper bound/WEIGHT_LEVELS
+WEIGHT_LEVELS = 2**16 - 1
+
+#Sections with the document norms and max frequencies, written after the index
+DOC_SECTIONS = [("norm_docs", "i"), ("norms", "d"), ("max_doc_freqs", "i")]
+
+#If set (e.g. to a cache.LRUCache), the decoded postings of CompressedIndex terms are kept here, so hot terms are only decoded once
+postings_cache = None
+
+#==============================================================================================
+
+#An entry of the inverted index. Only doc_freq and postings are filled in while the index is being built
+IndexEntry = namedtuple("IndexEntry", ["doc_freq", "postings", "upper_bound", "idf", "weights"])
+
+#The same index, stored in a few contiguous arrays instead of one list of tuples per term (see compact_index)
+CompactIndex = namedtuple("CompactIndex", ["lexicon", "doc_freqs", "upper_bounds", "idfs", "offsets", "doc_ids", "freqs", "weights", "pos_offsets", "positions"])
+
+#A CompactIndex where document ids, frequencies and positions are compressed (see compress_index)
+CompressedIndex = namedtuple("CompressedIndex", ["codec", "lexicon", "doc_freqs", "upper_bounds", "idfs", "offsets", "weights", "block_starts", "block_last_docs", "block_offsets", "postings", "block_pos_offsets", "positions"])
+
+#==============================================================================================
+
+def read_words(docs_path, doc_ids=None, start=0, end=None):
+    '''
+    Yields the id and the list of words of each document, one document at a time.
+
+    docs_path is either a directory with one file per document and one word per line (e.g. proj/docs/),
+    or a .jsonl file created by dataset.write_documents, which is streamed in a single pass (see dataset.read_documents).
+    - doc_ids: The ids of the documents to read. By default, every document in docs_path is read.
+    Documents that don't exist are skipped.
+    - start, end: For a .jsonl file, only the lines starting in this range of bytes are read (see dataset.split_documents)
+    '''
+
+    if docs_path.endswith(".jsonl"):
+        doc_ids = None if doc_ids is None else set(doc_ids)
+
+        for i, text in dataset.read_documents(docs_path, start, end):
+            if doc_ids is None or i in doc_ids:
+                yield i, [word.strip() for word in text.split(" ")]
+    else:
+        if doc_ids is None:
+            doc_ids = dataset.document_ids(docs_path)
+
+        for i in doc_ids:
+            try:
+                with open(docs_path + f"{i:05}") as f:
+                    words = [word.strip() for word in f]
+            except FileNotFoundError:
+                continue
+
+            yield i, words
+
+#==============================================================================================
+
+def document_postings(doc_id: int, words: list) -> dict:
+    '''
+    Returns the postings of a single document: for each of its terms, a tuple of (doc_id, frequency, [word positions])
+    '''
+
+    temp = dict() #For each word, give the number of occurencies in the current document
+    pos = dict()
+
+    #First get the occurencies and the positions for each term
+    for linecount, word in enumerate(words, start=1):
+        if word in temp:
+            temp[word] += 1
+            pos[word].append(linecount)
+        else:
+            temp[word] = 1
+            pos[word] = [linecount]
+
+    return {term: (doc_id, freq, pos[term]) for term, freq in temp.items()}
+
+#==============================================================================================
+
+def index_documents(docs_path, doc_ids=None, start=0, end=None):
+    '''
+    Creates a partial inverted index from the documents in docs_path (see read_words for the arguments).
+    Documents that don't exist are skipped.
+
+    Returns:
+    - The partial index, as a dictionary of terms. For each term, a list of occurencies (document_id, frequency, [word positions]),
+    in the order the documents were read
+    - A dictionary of documents containing their max frequency
+    - The number of documents that were read
+    '''
+
+    index = dict()
+
+    max_doc_freq = dict() #id: int => max_freq: int
+
+    N = 0 #Number of documents
+
+    for i, words in read_words(docs_path, doc_ids, start, end):
+        doc_postings = document_postings(i, words)
+
+        #Updating the inverted file using data from the new document
+        for term, posting in doc_postings.items():
+            if term in index:
+                index[term].append(posting)
+            else:
+                index[term] = [posting]
+
+        if doc_postings:
+            max_doc_freq[i] = max(p[1] for p in doc_postings.values())
+
+        N += 1
+
+    return index, max_doc_freq, N
 
 #==============================================================================================
 
-def write_index(docs_path, weighting_method):
+def write_index(docs_path, weighting_method, compact=False, codec=None, processes=1):
     '''
     Creates an inverted index from the documents in docs_path.
     It writes the resulting index to disk as "inverted_index.txt".
     It also returns the index as a dictionary of terms.
 
-    For each term, a tuple of (document frequency, occurencies).
+    For each term, an IndexEntry tuple of (document frequency, occurencies, upper bound, idf, weights).
     "occurencies" is an array of occurencies.
     Each occurence is represented as a tuple of (document_id, frequency, [word positions]).
+    "upper bound" is the largest normalized weight the term has in any document (see search_wand).
+    "idf" is the term's inverse document frequency, used for the query weights.
+    "weights" contains the normalized weight of each occurence for the given weighting_method, in the same order.
 
-    - docs_path: A path (e.g. proj/docs/) to a directory will all the documents
+    - docs_path: A path (e.g. proj/docs/) to a directory will all the documents, or the .jsonl file of dataset.write_documents
+    - weighting_method: One of the scorers in scoring.SCORERS (0: tfc, 1: txc, 2: BM25, 3: BM25+)
+    - compact: If True, the index is converted with compact_index before being returned
+    - codec: If set, the index is also compressed with compress_index using this codec ("vbyte" or "bitpack")
+    - processes: If more than 1, the documents are split into shards of consecutive documents
+    (ranges of lines of a .jsonl file, or ranges of ids of a directory), which are indexed in parallel
+    by a pool of processes and then merged
 
     Returns:
     - The index
@@ -24,202 +189,1298 @@ def write_index(docs_path, weighting_method):
     - A dictionary of terms containing their max frequency between all documents
     '''
 
-    index = dict()
+    if processes > 1:
+        #More shards than processes, so that a slow shard doesn't keep the other processes waiting
+        num_shards = 4*processes
 
-    max_doc_freq = dict() #id: int => max_freq: int
+        if docs_path.endswith(".jsonl"):
+            #Each process only reads its own range of bytes of the file
+            ranges = dataset.split_documents(docs_path, num_shards)
+            shards = (repeat(None), [start for start, _ in ranges], [end for _, end in ranges])
+        else:
+            doc_ids = dataset.document_ids(docs_path)
+            shard_size = max(1, math.ceil(len(doc_ids)/num_shards))
+            shards = ([doc_ids[i:i + shard_size] for i in range(0, len(doc_ids), shard_size)], repeat(0), repeat(None))
 
-    N = 0 #Number of documents
+        with ProcessPoolExecutor(processes) as pool:
+            partial_indexes = list(pool.map(index_documents, repeat(docs_path), *shards))
+    else:
+        partial_indexes = [index_documents(docs_path)]
+
+    if not partial_indexes:
+        partial_indexes = [(dict(), dict(), 0)]
+
+    #Merge the partial indexes. Shards are in order of document id, so the merged postings stay sorted
+    #The norms are calculated below, after the merge, so they use the statistics of the whole collection
+    index, max_doc_freq, N = partial_indexes[0]
+
+    for partial_index, partial_max_doc_freq, partial_N in partial_indexes[1:]:
+        for term, postings in partial_index.items():
+            if term in index:
+                index[term] += postings
+            else:
+                index[term] = postings
 
-    for i in range(1, 1240):
-        linecount = 1
-        temp = dict() #For each word, give the number of occurencies in the current document
-        pos = dict()
+        max_doc_freq.update(partial_max_doc_freq)
+        N += partial_N
 
-        #First get the occurencies and the positions for each term
-        try:
-            f = open(docs_path + f"{i:05}")
+    #Write final index to file
+    #=====================================================================================================
+    with open("results/inverted_index.txt", "w") as out:
+        for term, postings in index.items():
+            #Each posting is p = (doc_id, num_occurencies, [list_of_occurencies])
             
-            for word in f:
-                word = word.strip()
+             #Store this term's document frequency in the index
+            out.write(f"{term}: ({len(postings)}, {postings})\n")
 
-                if word in temp:
-                    temp[word] += 1
-                    pos[word].append(linecount)
-                else:
-                    temp[word] = 1
-                    pos[word] = [linecount]
+    index, doc_norms = finalize_index(index, max_doc_freq, N, weighting_method)
 
-                linecount += 1
+    if compact or codec is not None:
+        index = compact_index(index)
 
-            f.close()
+    if codec is not None:
+        index = compress_index(index, codec)
+
+    return index, doc_norms, max_doc_freq
+
+#==============================================================================================
+
+def finalize_index(postings: dict, max_doc_freq: dict, N: int, weighting_method: int):
+    '''
+    Calculates the document norms and the weights of an index, given the postings of each term.
+    The postings dictionary is not modified.
+
+    - postings: A dictionary of terms. For each term, a list of occurencies (document_id, frequency, [word positions]),
+    sorted by document id
+    - max_doc_freq: A dictionary of documents containing their max frequency
+    - N: The number of documents in the collection
+    - weighting_method: One of the scorers in scoring.SCORERS
+
+    Returns:
+    - The index, as returned by write_index
+    - A dictionary of documents containing their norms. For scorers without cosine normalization, all norms are 1
+    '''
+
+    index = dict()
 
-            #Updating the inverted file using data from the new document
-            for term, freq in temp.items():
-                if term in index:
-                    index[term].append((i, freq, pos[term]))
-                else:
-                    index[term] = [(i, freq, pos[term])]
+    scorer = scoring.get_scorer(weighting_method)
 
-                if i in max_doc_freq:
-                    max_doc_freq[i] = max(max_doc_freq[i], freq)
-                else:
-                    max_doc_freq[i] = freq
+    doc_lengths = dict() #id: int => number of words
 
-            N += 1
+    for term_postings in postings.values():
+        for p in term_postings:
+            doc_lengths[p[0]] = doc_lengths.get(p[0], 0) + p[1]
 
-        except FileNotFoundError as ferr:
-            continue
+    stats = scoring.collection_statistics(scorer, N, max_doc_freq, doc_lengths)
 
     #Calculate the norms of each document in the collection, examining one term at a time
-    #Write final index to file
     #=====================================================================================================
 
     doc_norms = dict() #id: int, norm: float
-    
-    with open("results/inverted_index.txt", "w") as out:
-        for term, postings in index.items():
-            #Each posting is p = (doc_id, num_occurencies, [list_of_occurencies])
-            
-             #Store this term's document frequency in the index
-            out.write(f"{term}: ({len(postings)}, {postings})\n")
-            index[term] = (len(postings), postings)
 
-            #Calculate this term's contribution to each document's norm
-            #====================================================================
-            for p in postings:
+    for term, term_postings in postings.items():
+
+        #Calculate this term's contribution to each document's norm
+        #====================================================================
+        for p in term_postings:
+
+            val = scorer.doc_weight(p[1], p[0], len(term_postings), stats) if scorer.normalize else 1
+
+            if p[0] in doc_norms: #If this text's norm has been initialized
+                doc_norms[p[0]] += val**2
+            else:
+                doc_norms[p[0]] = val**2
+
+    for doc in doc_norms:
+        doc_norms[doc] = math.sqrt(doc_norms[doc]) if scorer.normalize else 1
+        #print(f"Document #{doc}: {doc_norms[doc]}")
+
+    #Precompute the normalized weight of every posting, so that searching only needs to add them up
+    #=====================================================================================================
+    for term, term_postings in postings.items():
+        doc_freq = len(term_postings)
+
+        weights = [scorer.doc_weight(p[1], p[0], doc_freq, stats)/doc_norms[p[0]] for p in term_postings]
+        #The largest weight is the max score contribution of the term, used for early termination
+        index[term] = IndexEntry(doc_freq, term_postings, max(weights), scorer.idf(N, doc_freq), weights)
+
+    return index, doc_norms
+
+#==============================================================================================
+
+#Estimated memory of the postings held in memory by write_index_external, in bytes
+RUN_POSTING_BYTES = 120 #For each posting: the tuple, its integers and the list of positions
+RUN_POSITION_BYTES = 36 #For each word position: the integer and its pointer in the list
+
+#==============================================================================================
+
+def write_run(run: dict, path: str):
+    '''
+    Writes a partial index to disk, as a sequence of pickled (term, postings) tuples sorted by term
+    '''
+
+    with open(path, "wb") as f:
+        for term in sorted(run):
+            pickle.dump((term, run[term]), f)
+
+#==============================================================================================
+
+def read_run(path: str):
+    '''
+    Yields the (term, postings) tuples of a run written by write_run, one at a time
+    '''
+
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                break
+
+#==============================================================================================
+
+def merge_runs(paths: list):
+    '''
+    k-way merge of the runs written by write_run, reading one term at a time from each run.
+    Yields (term, postings) tuples sorted by term, where the postings of a term in all runs are concatenated
+    in the order of paths.
+    '''
+
+    #On equal terms, heapq.merge keeps the order of the runs, so the postings stay sorted by document id
+    merged = heapq.merge(*(read_run(path) for path in paths), key=lambda entry: entry[0])
+
+    for term, entries in groupby(merged, key=lambda entry: entry[0]):
+        postings = []
+
+        for _, run_postings in entries:
+            postings += run_postings
+
+        yield term, postings
+
+#==============================================================================================
+
+def write_index_external(docs_path, weighting_method, memory_budget, index_path="results/inverted_index.bin", runs_path="results/runs/", codec=None):
+    '''
+    Creates the same index as write_index(docs_path, weighting_method, compact=True, codec=codec) and saves it to index_path
+    as save_index would, for collections whose postings don't fit in memory (SPIMI indexing).
+
+    The documents are read one at a time into an in-memory partial index. Whenever its estimated size reaches memory_budget (in bytes),
+    it is written to disk as a run, sorted by term, and a new partial index is started.
+    In the end, the runs are merged twice, one term at a time: first to calculate the document norms,
+    and then to stream the weighted postings into the binary index file (see save_index_terms).
+    Only the current term of each run is kept as a list of tuples. The runs are deleted afterwards.
+    In the index, terms are sorted alphabetically.
+
+    - index_path: The binary index file
+    - runs_path: A directory for the runs
+    - codec: If set, the postings are compressed with this codec, as in compress_index
+
+    The index file records index_source(docs_path), taken before the documents are read.
 
-                val = calculate_weight(p[1], max_doc_freq[p[0]], N, len(postings), weighting_method)
+    Returns the same values as load_index(index_path).
+    '''
+
+    os.makedirs(runs_path, exist_ok=True)
+
+    source = index_source(docs_path)
+
+    runs = []
+    run = dict()
+    run_size = 0
+
+    max_doc_freq = dict() #id: int => max_freq: int
+    doc_lengths = dict() #id: int => number of words
+    N = 0 #Number of documents
+
+    #The documents are streamed once, in the order they are stored
+    for i, words in read_words(docs_path):
+        doc_postings = document_postings(i, words)
+
+        for term, posting in doc_postings.items():
+            if term in run:
+                run[term].append(posting)
+            else:
+                run[term] = [posting]
+
+            run_size += RUN_POSTING_BYTES + RUN_POSITION_BYTES*len(posting[2])
+
+        if doc_postings:
+            max_doc_freq[i] = max(p[1] for p in doc_postings.values())
+            doc_lengths[i] = len(words)
+
+        N += 1
+
+        if run_size >= memory_budget:
+            runs.append(os.path.join(runs_path, f"run_{len(runs):05}"))
+            write_run(run, runs[-1])
+
+            run = dict()
+            run_size = 0
+
+    if run:
+        runs.append(os.path.join(runs_path, f"run_{len(runs):05}"))
+        write_run(run, runs[-1])
+
+    del run
 
-                if p[0] in doc_norms: #If this text's norm has been initialized
-                    doc_norms[p[0]] += val**2
-                else:
-                    doc_norms[p[0]] = val**2
+    scorer = scoring.get_scorer(weighting_method)
+    stats = scoring.collection_statistics(scorer, N, max_doc_freq, doc_lengths)
+
+    #Calculate the norms of each document in the collection, examining one term at a time
+    #=====================================================================================================
+    doc_norms = dict() #id: int, norm: float
+
+    if scorer.normalize:
+        for term, postings in merge_runs(runs):
+            for p in postings:
+                val = scorer.doc_weight(p[1], p[0], len(postings), stats)
+                doc_norms[p[0]] = doc_norms.get(p[0], 0) + val**2
 
         for doc in doc_norms:
             doc_norms[doc] = math.sqrt(doc_norms[doc])
-            #print(f"Document #{doc}: {doc_norms[doc]}")
+    else:
+        doc_norms = {doc: 1 for doc in doc_lengths}
 
-    return index, doc_norms, max_doc_freq
+    #Write the index with the normalized weights
+    #=====================================================================================================
+    def weighted_terms():
+        for term, postings in merge_runs(runs):
+            doc_freq = len(postings)
+            weights = [scorer.doc_weight(p[1], p[0], doc_freq, stats)/doc_norms[p[0]] for p in postings]
+
+            yield term, IndexEntry(doc_freq, postings, max(weights), scorer.idf(N, doc_freq), weights)
+
+    save_index_terms(index_path, weighted_terms(), doc_norms, max_doc_freq, weighting_method, codec, source)
+
+    for path in runs:
+        os.remove(path)
+
+    return load_index(index_path)
 
 #==============================================================================================
 
-def freq(index: dict, term: str, doc_id: int):
+def compact_index(index: dict) -> CompactIndex:
     '''
-        Return a term's frequency inside of a document.
-        Uses binary search to locate the requested doc_id, assuming that the postings list is sorted by document id.
+    Converts the index returned by write_index into a CompactIndex, where all postings are stored in contiguous arrays.
+    Each posting takes a few bytes instead of a tuple and a list of Python objects.
+
+    - lexicon: A dictionary of terms, giving each term's id
+    - doc_freqs, upper_bounds, idfs: The document frequency, upper bound and idf of each term id
+    - offsets: The postings of term id t are stored from offsets[t] up to (not including) offsets[t+1]
+    - doc_ids, freqs, weights: The document id, frequency and normalized weight of each posting.
+    For each term, the postings are sorted by document id.
+    - pos_offsets: The word positions of posting i are stored from pos_offsets[i] up to (not including) pos_offsets[i+1]
+    - positions: The word positions of all postings
     '''
-    postings = index[term][1]
 
-    low = 0
-    high = len(postings) - 1
+    compact = CompactIndex(dict(), array("i"), array("d"), array("d"), array("q", [0]), array("i"), array("i"), array("d"), array("q", [0]), array("i"))
 
-    while low <= high:
-        mid = (low + high) // 2
-        val = postings[mid][0]
+    for term, entry in index.items():
+        append_term(compact, term, entry)
 
-        if val == doc_id:
-            #print(postings[mid])
-            return postings[mid][1]
-        elif val < doc_id:
-            low = mid + 1
-        else:
-            high = mid - 1
+    return compact
 
-    return 0
+#==============================================================================================
+
+def append_term(compact: CompactIndex, term: str, entry: IndexEntry):
+    '''
+    Adds a term of the index returned by write_index to the end of a CompactIndex
+    '''
+
+    compact.lexicon[term] = len(compact.doc_freqs)
+    compact.doc_freqs.append(entry.doc_freq)
+    compact.upper_bounds.append(entry.upper_bound)
+    compact.idfs.append(entry.idf)
+
+    for p, weight in zip(entry.postings, entry.weights):
+        compact.doc_ids.append(p[0])
+        compact.freqs.append(p[1])
+        compact.weights.append(weight)
+        compact.positions.extend(p[2])
+        compact.pos_offsets.append(len(compact.positions))
+
+    compact.offsets.append(len(compact.doc_ids))
+
+#==============================================================================================
+
+def compress_index(index: CompactIndex, codec: str = "vbyte") -> CompressedIndex:
+    '''
+    Compresses the postings of a CompactIndex.
+    The postings of each term are split into blocks of compression.BLOCK_SIZE. Each block stores its document ids as gaps,
+    followed by the frequencies, using the given codec ("vbyte" or "bitpack").
+    The word positions of each posting are stored as gaps with Variable-Byte encoding, one posting after the other.
+    The weights are quantized to 16 bits (see WEIGHT_LEVELS), relative to the upper bound of their term.
+    The error of a weight is at most 1/131070 of the upper bound, so documents with almost equal similarities
+    can be ranked in a different order than with the CompactIndex.
+
+    - codec, lexicon, doc_freqs, upper_bounds, idfs, offsets: Same as in CompactIndex
+    - weights: The quantized weight of each posting
+    - block_starts: The blocks of term id t are block_starts[t] up to (not including) block_starts[t+1]
+    - block_last_docs: The last document id of each block. Used as a skip pointer, to find the block of a document
+    without decoding the blocks before it
+    - block_offsets: Block b is stored from postings[block_offsets[b]] up to (not including) postings[block_offsets[b+1]]
+    - postings: The encoded blocks
+    - block_pos_offsets: The word positions of the postings of block b are stored from positions[block_pos_offsets[b]]
+    up to (not including) positions[block_pos_offsets[b+1]]. The frequencies give the number of positions of each posting
+    - positions: The encoded word positions
+    '''
+
+    weights = numpy.asarray(index.weights, dtype=numpy.float64)
+    doc_freqs = numpy.asarray(index.doc_freqs, dtype=numpy.int64)
+    scales = numpy.repeat(numpy.asarray(index.upper_bounds, dtype=numpy.float64), doc_freqs)/WEIGHT_LEVELS
+
+    #Terms in every document have a weight of 0 (their upper bound too) with tfc
+    quantized = numpy.round(numpy.divide(weights, scales, out=numpy.zeros(len(weights)), where=scales > 0))
+
+    compressed = CompressedIndex(codec, index.lexicon, index.doc_freqs, index.upper_bounds, index.idfs, index.offsets,
+                                 array("H", quantized.astype(numpy.uint16).tobytes()),
+                                 array("q", [0]), array("i"), array("q", [0]), bytearray(), array("q", [0]), bytearray())
+
+    for term_id in range(len(index.doc_freqs)):
+        start, end = index.offsets[term_id], index.offsets[term_id + 1]
+        base = 0
+
+        for block_start in range(start, end, compression.BLOCK_SIZE):
+            block_end = min(block_start + compression.BLOCK_SIZE, end)
+            doc_ids = index.doc_ids[block_start:block_end]
+
+            compression.encode_block(doc_ids, index.freqs[block_start:block_end], base, codec, compressed.postings)
+            base = doc_ids[-1]
+
+            compressed.block_last_docs.append(base)
+            compressed.block_offsets.append(len(compressed.postings))
+
+            for i in range(block_start, block_end):
+                positions = index.positions[index.pos_offsets[i]:index.pos_offsets[i + 1]]
+                compression.vbyte_encode(compression.delta_encode(positions), compressed.positions)
+
+            compressed.block_pos_offsets.append(len(compressed.positions))
+
+        compressed.block_starts.append(len(compressed.block_last_docs))
+
+    return compressed._replace(postings=bytes(compressed.postings), positions=bytes(compressed.positions))
 
 #==============================================================================================
-def calculate_weight(f, max_doc_freq, num_docs, doc_freq, weighting_method):
+
+def decode_postings(index: CompressedIndex, term_id: int, block: int = None):
     '''
-    Calculate TF-IDF for a document with one of two implementations
-    Which implementation gets used is determined by the weighting_method parameter.
+    Decodes the document ids and frequencies of a term in a CompressedIndex.
+    If block is given, only that block (an index into block_last_docs) gets decoded.
+    The blocks are decoded with numpy: all at once with vbyte, one at a time with bitpack.
+
+    Returns:
+    - The document ids
+    - The frequencies
     '''
 
-    if weighting_method == 0: #tfc
-        return f*math.log(num_docs/doc_freq, 10)
-    else: #txc
-        return f
-    
+    first_block = index.block_starts[term_id]
+    start, end = (first_block, index.block_starts[term_id + 1]) if block is None else (block, block + 1)
+
+    #Every block is full, except for the last block of the term
+    counts = numpy.minimum(compression.BLOCK_SIZE, index.doc_freqs[term_id] - (numpy.arange(start, end) - first_block)*compression.BLOCK_SIZE)
+
+    if index.codec == "vbyte":
+        #Each block is its gaps followed by its frequencies
+        values = compression.vbyte_decode_array(index.postings, index.block_offsets[start], index.block_offsets[end])
+
+        if len(counts) == 1:
+            gaps, freqs = values[:counts[0]], values[counts[0]:]
+        else:
+            block_of_posting = numpy.repeat(numpy.arange(len(counts)), counts)
+            gap_positions = numpy.arange(counts.sum()) + numpy.repeat(numpy.cumsum(counts) - counts, counts)
+
+            gaps = values[gap_positions]
+            freqs = values[gap_positions + counts[block_of_posting]]
+    else:
+        gaps, freqs = [], []
+
+        for b, count in zip(range(start, end), counts.tolist()):
+            block_gaps, offset = compression.bitpack_decode_array(index.postings, index.block_offsets[b], count)
+            block_freqs, _ = compression.bitpack_decode_array(index.postings, offset, count)
+
+            gaps.append(block_gaps)
+            freqs.append(block_freqs)
+
+        gaps, freqs = numpy.concatenate(gaps), numpy.concatenate(freqs)
+
+    #The first gap of each block is taken from the last document of the previous block, so the gaps of consecutive blocks add up
+    base = index.block_last_docs[start - 1] if start > first_block else 0
+
+    return (numpy.cumsum(gaps) + base).tolist(), freqs.tolist()
+
 #==============================================================================================
-def calculate_query_weight(f, max_query_freq, num_docs, doc_freq, weighting_method):
+
+def save_index(path: str, index, doc_norms: dict, max_doc_freq: dict, weighting_method: int, source: tuple = None):
     '''
-    Calculate TF-IDF for a query with one of two implementations.
-    Which implementation gets used is determined by the weighting_method parameter.
+    Writes a CompactIndex or a CompressedIndex, along with the document norms and max frequencies,
+    to a binary file that load_index can open.
+
+    The file starts with INDEX_MAGIC, the weighting method, the codec (its position in INDEX_CODECS),
+    the size of the source and of the lexicon in bytes and the size of every section in INDEX_SECTIONS and DOC_SECTIONS.
+    Then comes the source (index_source of the documents that the index was built from, as json, or nothing if it is None),
+    the lexicon (all terms separated by newlines, in order of term id) and the raw contents of each section, in machine byte order.
+    Every part starts at a multiple of 8 bytes.
     '''
 
-    return (0.5 + 0.5*f/max_query_freq)*math.log(num_docs/doc_freq, 10) 
+    codec = index.codec if isinstance(index, CompressedIndex) else None
 
+    lexicon = "\n".join(index.lexicon).encode("utf-8")
+    parts = [lexicon] + [bytes(getattr(index, name)) for name, _ in index_sections(codec)] + doc_sections(doc_norms, max_doc_freq)
+
+    write_index_file(path, weighting_method, codec, source, parts)
 
 #==============================================================================================
 
-def search(index: dict, doc_norms: dict, max_doc_freq: dict, query: str, num_results: int, weighting_method: int) -> list:
+def save_index_terms(path: str, terms, doc_norms: dict, max_doc_freq: dict, weighting_method: int, codec: str = None, source: tuple = None):
     '''
-    Search using the Vector Space Model.
+    Writes the same binary file as save_index, for an index given as an iterable of (term, IndexEntry) tuples in order of term id
+    (e.g. built from merge_runs), and compressed with codec if it is set.
 
-    Parameters:
-        - index: The inverted file returned by write_index
-        - doc_norms: The norms of all documents, returned by write_index
-        - max_doc_freq: The frequency of the most frequent term for each document, returned by write_index
-        - query: ...query
-        - num_results: The number of document that the model should return
-        - weighting_method: Which implementation of TF-IDF weights should be used (0 or 1)
+    Only one term is in memory at a time. It is converted with compact_index (and compress_index), and each of its sections
+    is appended to a temporary file next to path. The temporary files are copied into path at the end.
+    '''
 
-    Returns:
-        - A list with the retrieved documents' IDs, sorted in descending order of similarity score
+    sections = index_sections(codec)
+    temp = {name: open(f"{path}.{name}.tmp", "wb+") for name in ["lexicon"] + [name for name, _ in sections]}
+
+    try:
+        lengths = dict() #section name => number of values written
+
+        for name, typecode in sections:
+            lengths[name] = 0
+
+            if name in INDEX_OFFSETS:
+                temp[name].write(bytes(array(typecode, [0])))
+                lengths[name] = 1
+
+        for term_id, (term, entry) in enumerate(terms):
+            temp["lexicon"].write((term if term_id == 0 else "\n" + term).encode("utf-8"))
+
+            part = compact_index({term: entry})
+
+            if codec is not None:
+                part = compress_index(part, codec)
+
+            #The offsets of the term start from 0, so they are shifted past the values of the previous terms
+            bases = {name: lengths[target] for name, target in INDEX_OFFSETS.items() if name in lengths}
+
+            for name, typecode in sections:
+                values = getattr(part, name)
+
+                if name in bases:
+                    values = array(typecode, (bases[name] + value for value in values[1:]))
+
+                temp[name].write(bytes(values))
+                lengths[name] += len(values)
+
+        parts = [temp["lexicon"]] + [temp[name] for name, _ in sections] + doc_sections(doc_norms, max_doc_freq)
+
+        write_index_file(path, weighting_method, codec, source, parts)
+    finally:
+        for name, f in temp.items():
+            f.close()
+            os.remove(f"{path}.{name}.tmp")
+
+#==============================================================================================
+
+def doc_sections(doc_norms: dict, max_doc_freq: dict) -> list:
+    '''
+    Returns the contents of the DOC_SECTIONS of a binary index file, in order of document id
     '''
-    
-    result_list = []
 
-    #Remove special characters from the query
-    remove_chars = str.maketrans('', '', '?,()')
-    query = query.translate(remove_chars).strip().upper().split()
+    docs = sorted(doc_norms)
 
-    term_set = set(filter(lambda term: term in index, query))
-    #print(term_set)
+    return [bytes(array("i", docs)), bytes(array("d", (doc_norms[doc] for doc in docs))), bytes(array("i", (max_doc_freq[doc] for doc in docs)))]
 
-    #Get max term frequency in query
-    max_query_freq = 0
+#==============================================================================================
 
-    for term in term_set:
-        temp = query.count(term)
+def write_index_file(path: str, weighting_method: int, codec: str, source: tuple, parts: list):
+    '''
+    Writes the header of a binary index file (see save_index), followed by its parts: the source, the lexicon and every section.
+    Each part is either a bytes-like object or a file opened for reading, whose whole contents are copied.
+    '''
 
-        if temp > max_query_freq:
-            max_query_freq = temp
+    parts = [b"" if source is None else json.dumps(source).encode("utf-8")] + parts
+    sizes = [part.seek(0, os.SEEK_END) if hasattr(part, "seek") else len(part) for part in parts]
 
-    #Get the similarity between the query and every document
-    for doc in range(1, 1240):
-    
-        if doc not in doc_norms:
-            continue
+    with open(path, "wb") as f:
+        f.write(INDEX_MAGIC)
+        f.write(struct.pack(f"<{len(parts) + 2}q", weighting_method, INDEX_CODECS.index(codec), *sizes))
 
-        similarity = 0
+        for part, size in zip(parts, sizes):
+            if hasattr(part, "seek"):
+                part.seek(0)
+                shutil.copyfileobj(part, f)
+            else:
+                f.write(part)
 
-        #Only the terms in the query contribute to the similarity
-        for term in term_set:
+            f.write(bytes(-size % 8))
 
-            #Query weight
-            query_weight = calculate_query_weight(query.count(term), max_query_freq, len(doc_norms.keys()), index[term][0], weighting_method)
+#==============================================================================================
 
-            #Document weight
-            #=======================================================
-            doc_weight = 0
+def index_sections(codec: str) -> list:
+    '''
+    Returns the sections of the binary index file for an index compressed with codec (None for a CompactIndex)
+    '''
+    return INDEX_SECTIONS[None if codec is None else "compressed"]
 
-            if term in index:
+#==============================================================================================
 
-                doc_weight = calculate_weight(freq(index, term, doc), max_doc_freq[doc], len(doc_norms.keys()), index[term][0], weighting_method)
+def index_source(docs_path) -> tuple:
+    '''
+    Identifies the documents in docs_path (a directory or a .jsonl file, see write_index), so that an index built
+    from them can be rebuilt once they change.
 
-                #print(f"{term}: {doc_weight}")
+    Returns a tuple of the absolute path, the total size in bytes and the latest modification time in nanoseconds
+    of docs_path and, for a directory, of the document files in it (those named by an id). Adding or removing a document
+    updates the modification time of the directory.
+    '''
 
-            similarity += doc_weight*query_weight
+    stats = [os.stat(docs_path)]
 
-        #Normalization
-        similarity /= doc_norms[doc]
+    if os.path.isdir(docs_path):
+        stats += [entry.stat() for entry in os.scandir(docs_path) if entry.name.isdigit()]
 
-        #print(doc, similarity)
+    return os.path.abspath(docs_path), sum(s.st_size for s in stats), max(s.st_mtime_ns for s in stats)
 
-        result_list.append((similarity, doc))
+#==============================================================================================
 
-    #Sort all documents by their similarity to the query
-    result_list = sorted(result_list, key = lambda x: x[0], reverse=True)
+def index_header(path: str) -> tuple:
+    '''
+    Returns a tuple of (weighting method, codec, source) that the binary index in path was built with,
+    or None if path is not such an index. The source is the index_source of its documents, or None if it wasn't recorded
+    '''
+
+    try:
+        with open(path, "rb") as f:
+            header = f.read(len(INDEX_MAGIC) + 24)
+
+            if len(header) < len(INDEX_MAGIC) + 24 or header[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+                return None
+
+            weighting_method, codec, source_size = struct.unpack("<3q", header[len(INDEX_MAGIC):])
+
+            #The source comes right after the sizes of every part
+            f.seek(len(INDEX_MAGIC) + 8*(len(index_sections(INDEX_CODECS[codec]) + DOC_SECTIONS) + 4))
+            source = f.read(source_size)
+    except FileNotFoundError:
+        return None
+
+    return weighting_method, INDEX_CODECS[codec], tuple(json.loads(source)) if source else None
+
+#==============================================================================================
+
+def load_index(path: str):
+    '''
+    Opens a binary index written by save_index.
+    The file is memory-mapped and the arrays of the returned index are views over it,
+    so only the lexicon and the per-document dictionaries get parsed.
+
+    Returns the same values as write_index:
+    - The index, as a CompactIndex or a CompressedIndex (depending on how it was saved)
+    - A dictionary of terms containing their norms
+    - A dictionary of terms containing their max frequency between all documents
+    '''
+
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if mm[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+        raise ValueError(f"{path} is not a binary index file")
+
+    codec = INDEX_CODECS[struct.unpack_from("<q", mm, len(INDEX_MAGIC) + 8)[0]]
+    index_types = index_sections(codec) + DOC_SECTIONS
+
+    #The source, the lexicon and every section
+    num_parts = len(index_types) + 2
+    sizes = struct.unpack_from(f"<{num_parts}q", mm, len(INDEX_MAGIC) + 16)
+
+    view = memoryview(mm)
+    offset = len(INDEX_MAGIC) + 8*(num_parts + 2)
+    parts = []
+
+    for size in sizes:
+        parts.append(view[offset:offset + size])
+        offset += size + (-size % 8)
+
+    terms = str(parts[1], "utf-8").split("\n") if sizes[1] else []
+    sections = {name: part.cast(typecode) for (name, typecode), part in zip(index_types, parts[2:])}
+
+    doc_norms = dict(zip(sections.pop("norm_docs"), sections.pop("norms")))
+    max_doc_freq = dict(zip(doc_norms, sections.pop("max_doc_freqs")))
+
+    lexicon = {term: term_id for term_id, term in enumerate(terms)}
+
+    if codec is None:
+        index = CompactIndex(lexicon=lexicon, **sections)
+    else:
+        index = CompressedIndex(codec=codec, lexicon=lexicon, **sections)
+
+    return index, doc_norms, max_doc_freq
+
+#==============================================================================================
+
+def freq(index: dict, term: str, doc_id: int):
+    '''
+        Return a term's frequency inside of a document.
+        Uses binary search to locate the requested doc_id, assuming that the postings list is sorted by document id.
+    '''
+    if isinstance(index, CompactIndex):
+        term_id = index.lexicon[term]
+        start, end = index.offsets[term_id], index.offsets[term_id + 1]
+
+        i = bisect_left(index.doc_ids, doc_id, start, end)
+
+        return index.freqs[i] if i < end and index.doc_ids[i] == doc_id else 0
+
+    if isinstance(index, CompressedIndex):
+        term_id = index.lexicon[term]
+
+        #Follow the skip pointers to the only block that can contain the document
+        block = bisect_left(index.block_last_docs, doc_id, index.block_starts[term_id], index.block_starts[term_id + 1])
+
+        if block == index.block_starts[term_id + 1]:
+            return 0
+
+        doc_ids, freqs = decode_postings(index, term_id, block)
+        i = bisect_left(doc_ids, doc_id)
+
+        return freqs[i] if i < len(doc_ids) and doc_ids[i] == doc_id else 0
+
+    postings = index[term][1]
+
+    low = 0
+    high = len(postings) - 1
+
+    while low <= high:
+        mid = (low + high) // 2
+        val = postings[mid][0]
+
+        if val == doc_id:
+            #print(postings[mid])
+            return postings[mid][1]
+        elif val < doc_id:
+            low = mid + 1
+        else:
+            high = mid - 1
+
+    return 0
+
+#==============================================================================================
+
+def parse_query(query: str) -> list:
+    '''
+    Normalises a query the same way for every search function:
+    removes special characters, converts it to upper case and splits it into terms.
+    '''
+    remove_chars = str.maketrans('', '', '?,()')
+    return query.translate(remove_chars).strip().upper().split()
+
+#==============================================================================================
+
+def query_weights(index: dict, doc_norms: dict, query: list, weighting_method: int) -> list:
+    '''
+    Calculates the weight of every query term that exists in the index.
+
+    Parameters:
+        - index: The inverted file returned by write_index
+        - doc_norms: The norms of all documents, returned by write_index
+        - query: The query, already split into terms by parse_query
+        - weighting_method: One of the scorers in scoring.SCORERS
+
+    Returns:
+        - A list of (term, query_weight) tuples, one for each distinct query term
+    '''
+
+    if isinstance(index, (CompactIndex, CompressedIndex)):
+        term_set = set(filter(lambda term: term in index.lexicon, query))
+        idf = lambda term: index.idfs[index.lexicon[term]]
+    else:
+        term_set = set(filter(lambda term: term in index, query))
+        idf = lambda term: index[term].idf
+
+    #Get the frequency of each term in the query, and the max among them
+    query_freq = {term: query.count(term) for term in term_set}
+    max_query_freq = max(query_freq.values(), default=0)
+
+    scorer = scoring.get_scorer(weighting_method)
+
+    #The idf stored in the index is reused
+    return [(term, scorer.query_weight(query_freq[term], max_query_freq, idf(term))) for term in term_set]
+
+#==============================================================================================
+
+def top_results(scores: dict, doc_norms: dict, num_results: int) -> list:
+    '''
+    Returns the ids of the num_results documents with the highest score, sorted in descending order of score.
+    Ties are broken by document id.
+
+    Documents that don't appear in scores (or have a score of 0) have no common terms with the query.
+    They are only returned, in ascending order of id, if fewer than num_results documents matched the query.
+    '''
+
+    #Bounded heap selection instead of sorting every scored document
+    result_list = heapq.nsmallest(num_results, ((-score, doc) for doc, score in scores.items() if score > 0))
+    result_list = [doc for _, doc in result_list]
+
+    #Pad with the non-matching documents
+    if len(result_list) < num_results:
+        matched = set(result_list)
+
+        for doc in sorted(doc_norms):
+            if len(result_list) == num_results:
+                break
+
+            if doc not in matched:
+                result_list.append(doc)
+
+    return result_list
+
+#==============================================================================================
+
+def search_taat(index: dict, doc_norms: dict, max_doc_freq: dict, query: str, num_results: int, weighting_method: int) -> list:
+    '''
+    Term-at-a-time evaluation, see score_taat.
+
+    Same parameters and return value as search.
+    '''
+
+    return top_results(score_taat(index, doc_norms, query, weighting_method), doc_norms, num_results)
+
+#==============================================================================================
+
+def score_taat(index: dict, doc_norms: dict, query: str, weighting_method: int) -> dict:
+    '''
+    Term-at-a-time evaluation.
+    Traverses the postings of one query term at a time, in order of document id, adding its contribution to an accumulator per document.
+    Only the documents that contain at least one query term are ever visited.
+    The document weights are already normalized in the index, so no further computation is needed.
+    Works with the index returned by write_index, a CompactIndex and a CompressedIndex.
+
+    Returns:
+        - A dictionary of the documents that contain at least one query term, containing their similarity to the query
+    '''
+
+    accumulators = dict() #id: int => similarity: float
+
+    for term, query_weight in query_weights(index, doc_norms, parse_query(query), weighting_method):
+        for doc, doc_weight in zip(*term_weights(index, term)):
+            accumulators[doc] = accumulators.get(doc, 0) + doc_weight*query_weight
+
+    return accumulators
+
+#==============================================================================================
+
+def term_weights(index, term: str):
+    '''
+    Returns the postings of a term as two sequences, sorted by document id:
+    - The document ids
+    - The normalized weights
+
+    Works with the index returned by write_index, a CompactIndex and a CompressedIndex.
+    '''
+
+    if isinstance(index, CompactIndex):
+        term_id = index.lexicon[term]
+        start, end = index.offsets[term_id], index.offsets[term_id + 1]
+        return index.doc_ids[start:end], index.weights[start:end]
+    elif isinstance(index, CompressedIndex):
+        term_id = index.lexicon[term]
+
+        #The index is stored along with the postings, since a different index could get the same id once this one is deleted
+        cached = postings_cache.get((id(index), term_id)) if postings_cache is not None else None
+
+        if cached is not None and cached[0] is index:
+            return cached[1]
+
+        start, end = index.offsets[term_id], index.offsets[term_id + 1]
+        weights = numpy.asarray(index.weights[start:end], dtype=numpy.float64)*(index.upper_bounds[term_id]/WEIGHT_LEVELS)
+        postings = (decode_postings(index, term_id)[0], weights.tolist())
+
+        if postings_cache is not None:
+            postings_cache.put((id(index), term_id), (index, postings))
+
+        return postings
+    else:
+        return [p[0] for p in index[term].postings], index[term].weights
+
+#==============================================================================================
+
+#search_batch sums the similarities of a batch into a dense (queries x documents) matrix only if it has at most
+#this many entries per posting of the batch. Otherwise, only the matched documents of each query are stored
+DENSE_BATCH_FACTOR = 8
+
+#==============================================================================================
+
+def search_batch(index, doc_norms: dict, max_doc_freq: dict, queries: list, num_results: int, weighting_method: int, batch_size: int = 1024, with_scores: bool = False) -> list:
+    '''
+    Searches many queries at once. Gives the same results as calling search for each query.
+
+    The queries are split into batches of batch_size. For each batch, the weights of all query terms are multiplied
+    with their postings (a sparse query-term matrix times the sparse term-document matrix of the index).
+    The products are summed per (query, document) pair with numpy.unique and a single numpy.bincount, so the similarities
+    are only stored for the documents that match each query, as in a sparse matrix with one row per query.
+    The top results of each row are then selected with numpy.partition.
+
+    Parameters:
+        - queries: A list of queries
+        - batch_size: The number of queries scored together. Each batch needs memory proportional to the total length
+        of the postings lists of its query terms, whatever the size of the collection
+        - with_scores: If True, each result is a (document id, similarity) tuple. Padded documents have a similarity of 0
+        - The rest are the same as in search
+
+    Returns:
+        - A list with the results of each query, as returned by search
+    '''
+
+    num_columns = max(doc_norms, default=0) + 1
+    all_docs = numpy.array(sorted(doc_norms), dtype=numpy.int64)
+
+    #The postings of each term as numpy arrays, converted once for all queries
+    postings = dict() #term: str => (document ids, weights)
+
+    results = []
+
+    for batch_start in range(0, len(queries), batch_size):
+        batch = queries[batch_start:batch_start + batch_size]
+
+        #Non-zero entries of the product: (query, document, weight*query_weight)
+        row_lengths = []
+        columns = []
+        values = []
+
+        for query in batch:
+            row_length = 0
+
+            for term, query_weight in query_weights(index, doc_norms, parse_query(query), weighting_method):
+                if term not in postings:
+                    doc_ids, weights = term_weights(index, term)
+                    postings[term] = (numpy.asarray(doc_ids, dtype=numpy.int64), numpy.asarray(weights, dtype=numpy.float64))
+
+                doc_ids, weights = postings[term]
+
+                columns.append(doc_ids)
+                values.append(weights*query_weight)
+                row_length += len(doc_ids)
+
+            row_lengths.append(row_length)
+
+        #Each (query, document) pair gets a key, and the products with the same key are summed
+        #The unique keys are sorted, so the pairs of each query are contiguous and sorted by document id
+        keys = numpy.repeat(numpy.arange(len(batch), dtype=numpy.int64)*num_columns, row_lengths)
+
+        if not columns:
+            similarity = numpy.zeros(0)
+        elif len(batch)*num_columns <= DENSE_BATCH_FACTOR*len(keys):
+            #The dense matrix is small enough: summing into it directly is faster than sorting the keys
+            similarity = numpy.bincount(keys + numpy.concatenate(columns), weights=numpy.concatenate(values), minlength=len(batch)*num_columns)
+            keys = numpy.flatnonzero(similarity)
+            similarity = similarity[keys]
+        else:
+            keys, inverse = numpy.unique(keys + numpy.concatenate(columns), return_inverse=True)
+            similarity = numpy.bincount(inverse.ravel(), weights=numpy.concatenate(values), minlength=len(keys))
+
+        row_starts = numpy.searchsorted(keys, numpy.arange(len(batch) + 1, dtype=numpy.int64)*num_columns)
+
+        for row in range(len(batch)):
+            matched = keys[row_starts[row]:row_starts[row + 1]] - row*num_columns
+            scores = similarity[row_starts[row]:row_starts[row + 1]]
+
+            matched, scores = matched[scores > 0], scores[scores > 0]
+
+            #Keep only the documents that can be in the top results (including ties with the last one)
+            if len(matched) > num_results > 0:
+                kth = numpy.partition(scores, len(matched) - num_results)[len(matched) - num_results]
+                matched, scores = matched[scores >= kth], scores[scores >= kth]
+
+            #Same order as top_results: descending similarity, ties broken by document id
+            order = numpy.lexsort((matched, -scores))[:num_results]
+            top, top_scores = matched[order], scores[order]
+
+            #Pad with the non-matching documents
+            if len(top) < num_results:
+                padding = all_docs[~numpy.isin(all_docs, top)][:num_results - len(top)]
+                top, top_scores = numpy.concatenate((top, padding)), numpy.concatenate((top_scores, numpy.zeros(len(padding))))
+
+            if with_scores:
+                results.append(list(zip(top.tolist(), top_scores.tolist())))
+            else:
+                results.append(top.tolist())
+
+    return results
+
+#==============================================================================================
+
+def search_daat(index: dict, doc_norms: dict, max_doc_freq: dict, query: str, num_results: int, weighting_method: int) -> list:
+    '''
+    Document-at-a-time evaluation.
+    Keeps one cursor per query term and moves all of them forward together in increasing document id order,
+    so that each document's similarity is fully calculated before moving on to the next one.
+    Works with the index returned by write_index, a CompactIndex and a CompressedIndex.
+
+    Every document visits every cursor in interpreted Python, so it is several times slower than search_taat, which search uses.
+
+    Same parameters and return value as search.
+    '''
+
+    scores = dict()
+
+    terms = query_weights(index, doc_norms, parse_query(query), weighting_method)
+
+    #The document ids and weights of each term
+    postings = [term_weights(index, term) for term, _ in terms]
+    cursors = [0 for _ in terms]
+
+    while True:
+        #The next document is the smallest id under any cursor
+        doc = min((postings[t][0][c] for t, c in enumerate(cursors) if c < len(postings[t][0])), default=None)
+
+        if doc is None:
+            break
+
+        similarity = 0
+
+        for t, (_, query_weight) in enumerate(terms):
+            doc_ids, weights = postings[t]
+            c = cursors[t]
+
+            if c < len(doc_ids) and doc_ids[c] == doc:
+                similarity += weights[c]*query_weight
+                cursors[t] += 1
+
+        scores[doc] = similarity
+
+    return top_results(scores, doc_norms, num_results)
+
+#==============================================================================================
+
+def search_wand(index: dict, doc_norms: dict, max_doc_freq: dict, query: str, num_results: int, weighting_method: int) -> list:
+    '''
+    Document-at-a-time evaluation with WAND (Weak AND) early termination.
+    Keeps the best num_results documents in a min-heap. The upper bounds stored in the index give the max similarity
+    a document can reach from a set of terms, so documents that cannot beat the worst document in the heap are skipped
+    without being scored, and the cursors jump over them using binary search.
+    Works with the index returned by write_index, a CompactIndex and a CompressedIndex.
+
+    Every step is interpreted Python, so on a collection of this size it is slower than search_taat, which search uses.
+
+    Same parameters and return value as search.
+    '''
+
+    if num_results < 1:
+        return []
+
+    terms = query_weights(index, doc_norms, parse_query(query), weighting_method)
+
+    #One cursor per term: [current position, document ids, weights, query weight, max contribution to the similarity]
+    #The upper bounds are slightly inflated so that rounding errors never cause a document to be skipped wrongly
+    cursors = [[0, *term_weights(index, term), query_weight, query_weight*upper_bound(index, term)*(1 + 1e-9)] for term, query_weight in terms]
+
+    heap = [] #(similarity, -doc_id), the worst result is always heap[0]
+    threshold = 0
+
+    def current(cursor):
+        return cursor[1][cursor[0]] if cursor[0] < len(cursor[1]) else math.inf
+
+    while True:
+        cursors.sort(key=current)
+
+        #Find the pivot: the first term where the accumulated upper bound could beat the threshold
+        pivot = None
+        bound = 0
+
+        for i, cursor in enumerate(cursors):
+            if current(cursor) == math.inf:
+                break
+
+            bound += cursor[4]
+
+            if bound > threshold:
+                pivot = i
+                break
+
+        if pivot is None:
+            break
+
+        pivot_doc = current(cursors[pivot])
+
+        if current(cursors[0]) == pivot_doc:
+            #All the cursors before the pivot are on the pivot document, so it gets fully scored
+            similarity = 0
+
+            for cursor in cursors:
+                if current(cursor) != pivot_doc:
+                    break
+
+                similarity += cursor[2][cursor[0]]*cursor[3]
+                cursor[0] += 1
+
+            if similarity > 0:
+                if len(heap) < num_results:
+                    heapq.heappush(heap, (similarity, -pivot_doc))
+                elif (similarity, -pivot_doc) > heap[0]:
+                    heapq.heapreplace(heap, (similarity, -pivot_doc))
+
+                if len(heap) == num_results:
+                    threshold = heap[0][0]
+        else:
+            #No document before the pivot document can beat the threshold
+            for cursor in cursors[:pivot]:
+                cursor[0] = bisect_left(cursor[1], pivot_doc, cursor[0])
+
+    return top_results({-doc: similarity for similarity, doc in heap}, doc_norms, num_results)
+
+#==============================================================================================
+
+def upper_bound(index, term: str) -> float:
+    '''
+    Returns the largest normalized weight of a term in any document (see write_index)
+    '''
+
+    if isinstance(index, (CompactIndex, CompressedIndex)):
+        return index.upper_bounds[index.lexicon[term]]
+
+    return index[term].upper_bound
+
+#==============================================================================================
+
+def doc_frequency(index, term: str) -> int:
+    '''
+    Returns the document frequency of a term, or 0 if it is not in the index
+    '''
+
+    if isinstance(index, (CompactIndex, CompressedIndex)):
+        return index.doc_freqs[index.lexicon[term]] if term in index.lexicon else 0
+
+    return index[term].doc_freq if term in index else 0
+
+#==============================================================================================
+
+def doc_positions(index, term: str, doc_ids: list) -> dict:
+    '''
+    Finds which of the documents in doc_ids contain a term, without scanning the whole postings list.
+    doc_ids must be sorted. Each document is located with a binary search that starts after the previous one.
+    In a CompressedIndex, the skip pointers (block_last_docs) locate the block of each document, and only those blocks get decoded.
+
+    Returns:
+        - A dictionary of the documents that contain the term, containing the term's word positions in them
+    '''
+
+    found = dict()
+
+    if isinstance(index, CompactIndex):
+        term_id = index.lexicon[term]
+        lo, end = index.offsets[term_id], index.offsets[term_id + 1]
+
+        for doc in doc_ids:
+            lo = bisect_left(index.doc_ids, doc, lo, end)
+
+            if lo == end:
+                break
+
+            if index.doc_ids[lo] == doc:
+                found[doc] = list(index.positions[index.pos_offsets[lo]:index.pos_offsets[lo + 1]])
+
+    elif isinstance(index, CompressedIndex):
+        term_id = index.lexicon[term]
+        block, last_block = index.block_starts[term_id], index.block_starts[term_id + 1]
+        decoded_block = None
+
+        for doc in doc_ids:
+            block = bisect_left(index.block_last_docs, doc, block, last_block)
+
+            if block == last_block:
+                break
+
+            if block != decoded_block:
+                block_doc_ids, block_freqs = decode_postings(index, term_id, block)
+                decoded_block = block
+
+                #The position gaps of every posting of the block, one posting after the other
+                block_positions = compression.vbyte_decode_array(index.positions, index.block_pos_offsets[block], index.block_pos_offsets[block + 1])
+                position_starts = [0] + list(accumulate(block_freqs))
+
+            i = bisect_left(block_doc_ids, doc)
+
+            if i < len(block_doc_ids) and block_doc_ids[i] == doc:
+                found[doc] = numpy.cumsum(block_positions[position_starts[i]:position_starts[i + 1]]).tolist()
+
+    else:
+        postings = index[term].postings
+        lo = 0
+
+        for doc in doc_ids:
+            lo = bisect_left(postings, doc, lo, key=lambda p: p[0])
+
+            if lo == len(postings):
+                break
+
+            if postings[lo][0] == doc:
+                found[doc] = postings[lo][2]
+
+    return found
+
+#==============================================================================================
+
+def phrase_matches(index, phrase: list) -> dict:
+    '''
+    Finds the documents that contain a phrase, i.e. its terms in consecutive positions.
+
+    The documents of the rarest term are the initial candidates. They are intersected with the postings of the other terms,
+    from rarest to most frequent, using doc_positions. Then, for each remaining document,
+    the positions of the i-th term, moved back by i, must have a common starting position.
+
+    - phrase: A list of terms, already normalized by parse_query
+
+    Returns:
+        - A dictionary of the documents that contain the phrase, containing the number of times it appears
+    '''
+
+    if not phrase or any(doc_frequency(index, term) == 0 for term in phrase):
+        return dict()
+
+    order = sorted(range(len(phrase)), key=lambda i: doc_frequency(index, phrase[i]))
+
+    candidates = list(term_weights(index, phrase[order[0]])[0])
+    positions = dict() #i: int => {doc: [positions]}
+
+    for i in order:
+        positions[i] = doc_positions(index, phrase[i], candidates)
+        candidates = [doc for doc in candidates if doc in positions[i]]
+
+        if not candidates:
+            return dict()
+
+    matches = dict()
+
+    for doc in candidates:
+        starts = set(positions[0][doc])
+
+        for i in range(1, len(phrase)):
+            starts &= {p - i for p in positions[i][doc]}
+
+        if starts:
+            matches[doc] = len(starts)
+
+    return matches
+
+#==============================================================================================
+
+def proximity_matches(index, terms: list, window: int) -> dict:
+    '''
+    Finds the documents where all the terms appear within window consecutive positions.
+
+    The candidate documents are found as in phrase_matches. For each candidate,
+    the positions of all terms are merged and scanned once, keeping the smallest span that contains every term.
+
+    - terms: A list of terms, already normalized by parse_query
+
+    Returns:
+        - A dictionary of the matching documents, containing the length of their smallest span
+    '''
+
+    terms = list(dict.fromkeys(terms))
+
+    if not terms or any(doc_frequency(index, term) == 0 for term in terms):
+        return dict()
+
+    terms.sort(key=lambda term: doc_frequency(index, term))
+
+    candidates = list(term_weights(index, terms[0])[0])
+    positions = []
+
+    for term in terms:
+        positions.append(doc_positions(index, term, candidates))
+        candidates = [doc for doc in candidates if doc in positions[-1]]
+
+    matches = dict()
+
+    for doc in candidates:
+        merged = sorted((p, t) for t in range(len(terms)) for p in positions[t][doc])
+
+        #Sliding window over the merged positions
+        counts = [0 for _ in terms]
+        missing = len(terms)
+        left = 0
+        span = math.inf
+
+        for p, t in merged:
+            if counts[t] == 0:
+                missing -= 1
+
+            counts[t] += 1
+
+            while missing == 0:
+                span = min(span, p - merged[left][0] + 1)
+
+                counts[merged[left][1]] -= 1
+
+                if counts[merged[left][1]] == 0:
+                    missing += 1
+
+                left += 1
+
+        if span <= window:
+            matches[doc] = span
+
+    return matches
+
+#==============================================================================================
+
+def parse_phrases(query: str) -> list:
+    '''
+    Returns the phrases of a query (the parts in double quotes), each one normalized by parse_query
+    '''
+    return [parse_query(phrase) for phrase in re.findall(r'"([^"]*)"', query)]
+
+#==============================================================================================
+
+def search_phrase(index, doc_norms: dict, max_doc_freq: dict, query: str, num_results: int, weighting_method: int, window: int = None) -> list:
+    '''
+    Search that takes word positions into account.
+
+    Only the documents that contain every phrase of the query (parts in double quotes, e.g. '"cystic fibrosis" treatment') are returned.
+    If window is set, all the terms of the query must also appear within window consecutive positions.
+    The matching documents are ranked by their similarity to the whole query, as in search.
+    Unlike search, the results are not padded with documents that don't match.
+
+    Same parameters and return value as search.
+    '''
+
+    matches = None
+
+    constraints = [phrase_matches(index, phrase) for phrase in parse_phrases(query)]
+
+    if window is not None:
+        constraints.append(proximity_matches(index, parse_query(query.replace('"', " ")), window))
+
+    for constraint in constraints:
+        matches = set(constraint) if matches is None else matches & set(constraint)
+
+    scores = score_taat(index, doc_norms, query.replace('"', " "), weighting_method)
+
+    if matches is not None:
+        scores = {doc: scores.get(doc, 0) for doc in matches}
+
+    return top_results(scores, {doc: doc_norms[doc] for doc in scores}, num_results)
+
+#==============================================================================================
+
+def search(index: dict, doc_norms: dict, max_doc_freq: dict, query: str, num_results: int, weighting_method: int) -> list:
+    '''
+    Search using the Vector Space Model.
+    Only the documents in the postings lists of the query terms are scored (see search_taat).
+
+    Parameters:
+        - index: The inverted file returned by write_index
+        - doc_norms: The norms of all documents, returned by write_index
+        - max_doc_freq: The frequency of the most frequent term for each document, returned by write_index
+        - query: ...query
+        - num_results: The number of document that the model should return
+        - weighting_method: Which weighting method should be used, one of the scorers in scoring.SCORERS (0: tfc, 1: txc, 2: BM25, 3: BM25+)
+
+    Returns:
+        - A list with the retrieved documents' IDs, sorted in descending order of similarity score
+    '''
 
-    #Only return top k results, and only the doc ids (NOT their similarity scores)
-    return list(map(lambda x: x[1], result_list[:num_results]))
\ No newline at end of file
+    return search_taat(index, doc_norms, max_doc_freq, query, num_results, weighting_method)